@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Requirement file discovery on a synthetic tree.
+
+Usage: python benchmarks/discovery.py [FOLDERS] [FILES_PER_FOLDER]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from requires_io.discovery import _walk, discover, DiscoveryCache
+
+
+def build(root, folders, files):
+    for i in range(folders):
+        # a few levels deep, a requirement file every 50 folders
+        folder = os.path.join(root, 'pkg%d' % (i % 20), 'mod%d' % (i % 200), 'sub%d' % i)
+        os.makedirs(folder)
+        for j in range(files):
+            open(os.path.join(folder, 'file%d.py' % j), 'w').close()
+        if i % 50 == 0:
+            open(os.path.join(folder, 'requirements.txt'), 'w').close()
+
+
+def measure(name, func, *args):
+    start = time.time()
+    found = func(*args)
+    print('%-16s %8.3f s  (%d files)' % (name, time.time() - start, len(found)))
+
+
+def main(folders=20000, files=20):
+    root = tempfile.mkdtemp()
+    try:
+        build(root, folders, files)
+        print('%d folders, %d files' % (folders, folders * files))
+        measure('os.walk', _walk, root)
+        for workers in (1, 4, 8, 16):
+            measure('scandir x%d' % workers, discover, root, workers)
+        cache = DiscoveryCache(os.path.join(root, 'cache.json'), racy_window=0)
+        measure('cache (cold)', discover, root, 4, cache)
+        measure('cache (warm)', discover, root, 4, cache)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Local parsing of large requirement, setup.py, tox and buildout files, and package index lookups.
+
+Usage: python benchmarks/parsers.py [LINES ...]   (default: 1000 100000)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from requires_io.index import PackageIndex
+from requires_io.parsers import BUILDOUT, REQUIREMENTS, SETUP, TOX, parse
+
+
+def requirements(lines):
+    return '\n'.join(('package-%d[extra]>=1.%d,<2.0 ; python_version >= "3"' if i % 4 == 0 else
+                      '-e git+https://example.com/p%d.git#egg=package-%d' if i % 4 == 1 else
+                      '# comment %d.%d' if i % 4 == 2 else
+                      'package-%d==1.%d.0 --hash=sha256:abcdef') % (i, i % 50) for i in range(lines)) + '\n'
+
+
+def setup(lines):
+    return 'from setuptools import setup\nrequires = [\n%s]\nsetup(name="bench", install_requires=requires)\n' % (
+        ''.join('    "package-%d>=1.%d",\n' % (i, i % 50) for i in range(lines)))
+
+
+def tox(lines):
+    deps = ''.join('    py%d: package-%d==1.%d\n' % (27 + i % 2, i, i % 50) for i in range(lines))
+    return '[testenv]\ndeps =\n%s' % deps
+
+
+def buildout(lines):
+    versions = ''.join('package-%d = 1.%d.0\n' % (i, i % 50) for i in range(lines))
+    return '[buildout]\nextends = base.cfg\n[versions]\n%s' % versions
+
+
+def measure(name, lines, func):
+    runs = 0
+    start = time.time()
+    while runs < 3 or time.time() - start < 1.0:
+        packages = func()
+        runs += 1
+    elapsed = (time.time() - start) / runs
+    print('%-14s %8d %10.4f %12.0f %10d' % (name, lines, elapsed, lines / elapsed, packages))
+
+
+def run(lines):
+    for file_type, build in ((REQUIREMENTS, requirements), (SETUP, setup), (TOX, tox), (BUILDOUT, buildout)):
+        text = build(lines)
+        measure(file_type, lines, lambda: len(parse(text, file_type).requirements))
+    root = tempfile.mkdtemp()
+    try:
+        index = PackageIndex(os.path.join(root, 'index.sqlite'))
+        releases = dict(('Package_%d' % i, ['1.%d.0' % j for j in range(i % 10)]) for i in range(lines))
+        measure('index refresh', lines, lambda: index.refresh(releases))
+        pins = parse(buildout(lines), BUILDOUT).requirements
+        measure('index lookup', lines, lambda: len(index.annotate(pins)))
+        index.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def main(*sizes):
+    print('%-14s %8s %10s %12s %10s' % ('parser', 'lines', 's/op', 'lines/s', 'packages'))
+    for lines in sizes or (1000, 100000):
+        run(lines)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
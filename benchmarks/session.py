@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Per-call latency of one-shot requests versus the pooled RequiresAPI session.
+
+Usage: python benchmarks/session.py [CALLS]
+"""
+import sys
+import timeit
+
+import requests
+
+from requires_io.api import RequiresAPI
+from requires_io.server import FakeServer
+
+
+def main(calls=500):
+    with FakeServer() as server:
+        api = RequiresAPI('1234', base_url=server.url)
+
+        def one_shot():
+            requests.put(api._get_repository_url('foo'), headers=api._get_headers(), data='{}').raise_for_status()
+
+        def pooled():
+            api.update_repository('foo', True)
+
+        for name, func in (('one-shot', one_shot), ('pooled', pooled)):
+            elapsed = timeit.timeit(func, number=calls)
+            print('%-10s %8.1f us/call' % (name, elapsed / calls * 1e6))
+        api.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Discovery, payload encoding, rendering and end-to-end updates against the fake server.
+
+Usage: python benchmarks/suite.py [FILES ...]   (default: 10 1000 100000)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from requires_io.commands import Commands, _to_urls
+from requires_io.discovery import DEFAULT_WORKERS, discover
+from requires_io.draw import CSV, draw, write_rows
+from requires_io.payload import CompressedPayload, ReferencePayload
+from requires_io.server import FakeServer
+
+CONTENT = 'Django==1.11.2\nrequests>=2.18\nsix==1.10.0\ncelery[redis]==4.1.0\n-r base.txt\n'
+
+
+def build(root, files):
+    # 100 requirement files per project, next to as many source files
+    for i in range(files):
+        folder = os.path.join(root, 'project%d' % (i // 100), 'requirements')
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'env%d.txt' % i), 'w') as fd:
+            fd.write(CONTENT)
+        open(os.path.join(folder, '..', 'module%d.py' % i), 'w').close()
+
+
+def requirements(count):
+    return [{
+        'package': {'name': 'package-%d' % i},
+        'specs': '==1.%d.0' % (i % 50),
+        'latest': {'version': '1.%d.0' % (i % 70)},
+        'status': 'outdated' if i % 3 else 'up-to-date',
+    } for i in range(count)]
+
+
+def measure(name, files, func, min_time=1.0, min_runs=3):
+    # repeat small cases until they last long enough to be measured
+    runs = 0
+    start = time.time()
+    while runs < min_runs or time.time() - start < min_time:
+        func()
+        runs += 1
+        if files >= 10000:
+            break
+    elapsed = (time.time() - start) / runs
+    print('%-14s %8d %10.4f %12.0f %10.1f' % (name, files, elapsed, files / elapsed, 1 / elapsed))
+
+
+def run(files):
+    root = tempfile.mkdtemp()
+    try:
+        build(root, files)
+        paths = _to_urls(discover(root, DEFAULT_WORKERS))
+        assert len(paths) == files, len(paths)
+        measure('discovery', files, lambda: discover(root, DEFAULT_WORKERS))
+        measure('encoding', files, lambda: b''.join(ReferencePayload(paths)))
+        measure('encoding gzip', files, lambda: b''.join(CompressedPayload(ReferencePayload(paths))))
+        rows = requirements(files)
+        measure('draw', files, lambda: draw(rows, stream=StringIO()))
+        measure('draw capped', files, lambda: draw(rows, stream=StringIO(), widths=(20, 20, 10, 10)))
+        measure('csv', files, lambda: write_rows(rows, CSV, StringIO()))
+        with FakeServer(token='1234') as server:
+            args = ['-t', '1234', '--api-url', server.url]
+            Commands().execute(['update-repo', '-r', 'bench', '--private'] + args)
+            measure('update-branch', files,
+                    lambda: Commands().execute(['update-branch', '-r', 'bench', '-n', 'master', root] + args))
+    finally:
+        shutil.rmtree(root)
+
+
+def main(*sizes):
+    print('%-14s %8s %10s %12s %10s' % ('benchmark', 'files', 's/op', 'files/s', 'ops/s'))
+    for files in sizes or (10, 1000, 100000):
+        run(files)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
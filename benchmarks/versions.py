@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Status of large requirement sets: memoized and batched evaluation against parsing every pin.
+
+Usage: python benchmarks/versions.py [PINS ...]   (default: 1000 100000)
+"""
+import sys
+import time
+
+from requires_io.versions import (_parse_specifier, _parse_version, contains, latest, parse_specifier, parse_version,
+                                  status, statuses)
+
+SPECS = ('==1.%d.0', '>=1.%d,<2', '~=1.%d', '!=1.%d.*', '==1.%d.0.post1', '<1.%drc1', '')
+
+
+def pins(count, packages=5000):
+    # many files pinning the same packages: few distinct strings
+    releases = dict((i, ['1.%d.%d' % (j, i % 3) for j in range(i % 40 + 1)]) for i in range(packages))
+    versions = dict((i, latest(releases[i])) for i in releases)
+    return [(SPECS[i % len(SPECS)] % (i % 50) if SPECS[i % len(SPECS)] else '', versions[i % packages])
+            for i in range(count)]
+
+
+def uncached(pins):
+    return [contains(_parse_specifier(specs), _parse_version(version)) for specs, version in pins]
+
+
+def unbatched(pins):
+    return [status(specs, version) for specs, version in pins]
+
+
+def cold(pins):
+    parse_version.cache_clear()
+    parse_specifier.cache_clear()
+    return statuses(pins)
+
+
+def measure(name, count, func, data):
+    runs = 0
+    start = time.time()
+    while runs < 3 or time.time() - start < 1.0:
+        func(data)
+        runs += 1
+    elapsed = (time.time() - start) / runs
+    print('%-14s %8d %10.4f %12.0f' % (name, count, elapsed, count / elapsed))
+
+
+def main(*sizes):
+    print('%-14s %8s %10s %12s' % ('evaluation', 'pins', 's/op', 'pins/s'))
+    for count in sizes or (1000, 100000):
+        data = pins(count)
+        measure('uncached', count, uncached, data)
+        measure('cold', count, cold, data)
+        measure('memoized', count, unbatched, data)
+        measure('batched', count, statuses, data)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Propagation latency of ``watch`` (file written -> branch updated on the fake server) and its idle CPU cost.
+
+Usage: python benchmarks/watch.py [EDITS]   (default: 10)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from requires_io.commands import Commands
+from requires_io.server import FakeServer
+
+DEBOUNCE = 0.5
+
+
+def wait_for(server, content, timeout=30):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            files = server.reference_content('bench', 'branches', 'dev')
+        except KeyError:
+            files = {}
+        if files.get('requirements.txt') == content:
+            return time.time()
+        time.sleep(0.005)
+    raise RuntimeError('branch not updated')
+
+
+def run(edits, poll=None):
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'requirements.txt')
+        with open(path, 'w') as fd:
+            fd.write('six==1.0.0\n')
+        with FakeServer(token='1234') as server:
+            args = ['-t', '1234', '--api-url', server.url, '-r', 'bench']
+            Commands().execute(['update-repo', '--private'] + args)
+            options = ['--debounce', str(DEBOUNCE)] + (['--poll', str(poll)] if poll else [])
+            thread = threading.Thread(target=Commands().execute,
+                                      args=(['watch', '-n', 'dev'] + options + args + [root],))
+            thread.daemon = True
+            thread.start()
+            wait_for(server, b'six==1.0.0\n')
+            cpu = time.process_time() if hasattr(time, 'process_time') else time.clock()
+            time.sleep(5)
+            idle = (time.process_time() if hasattr(time, 'process_time') else time.clock()) - cpu
+            latencies = []
+            for i in range(edits):
+                content = ('six==1.%d.0\n' % (i + 1)).encode('ascii')
+                start = time.time()
+                with open(path, 'wb') as fd:
+                    fd.write(content)
+                latencies.append(wait_for(server, content) - start)
+        latencies.sort()
+        print('%-14s %10.3f %10.3f %10.3f %12.2f' % ('poll %ss' % poll if poll else 'inotify', latencies[0],
+                                                     latencies[len(latencies) // 2], latencies[-1], idle * 1000 / 5))
+    finally:
+        shutil.rmtree(root)
+
+
+def main(edits=10):
+    print('debounce: %ss' % DEBOUNCE)
+    print('%-14s %10s %10s %10s %12s' % ('watcher', 'min (s)', 'median (s)', 'max (s)', 'idle ms/s'))
+    run(edits)
+    run(edits, poll=1.0)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Long-running reporting of sites, uploading only the changes.
+
+Each round, the agent checks whether the packages of its sites changed: when
+the ``site-packages`` folders were not modified since the last check (their
+modification time changes with each install, upgrade or removal), nothing is
+read at all. Otherwise the packages are listed and compared with the last
+reported snapshot, kept on disk so that restarts do not report again, and
+the site is uploaded if they differ, at most once every ``min_interval``
+seconds. Rounds are ``interval`` seconds apart plus a random delay of up to
+``jitter`` seconds, and the first one starts after such a delay too, so that
+hosts started together do not report together.
+"""
+import logging
+import os
+import random
+import re
+import time
+
+from requires_io.cache import Manifest, default_cache_dir
+from requires_io.consts import NATIVE
+from requires_io.discovery import RACY_WINDOW, is_racy, mtime_ns
+from requires_io.freeze import FreezePayload, collect, site_paths
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300
+DEFAULT_MIN_INTERVAL = 900
+
+_line_re = re.compile(r'^\s*(?P<name>[^\s=#][^\s=]*)\s*==\s*(?P<version>\S+)')
+
+
+def packages(body):
+    """``{name: version}`` of the packages of a site report body."""
+    if isinstance(body, FreezePayload):
+        return dict(body.packages)
+    matches = (_line_re.match(line) for line in body.splitlines())
+    return dict(match.groups() for match in matches if match)
+
+
+def diff(old, new):
+    """Names of the packages added, removed and changed between two snapshots."""
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(name for name in set(old) & set(new) if old[name] != new[name])
+    return added, removed, changed
+
+
+class SiteAgent(object):
+    """Report ``sites`` (a ``{name: site paths}`` mapping, ``None`` for this environment) of ``repository``.
+
+    Snapshots are kept in ``state`` (a :class:`Manifest`, default:
+    ``sites.json`` in ``REQUIRES_CACHE_DIR``). Folders modified less than
+    ``racy_window`` seconds before a check are listed again on the next one
+    (see :data:`~requires_io.discovery.RACY_WINDOW`).
+    """
+
+    def __init__(self, api, repository, sites, collector=NATIVE, interval=DEFAULT_INTERVAL, jitter=None,
+                 min_interval=DEFAULT_MIN_INTERVAL, state=None, racy_window=RACY_WINDOW, seed=None):
+        self.api = api
+        self.repository = repository
+        self.sites = sites
+        self.collector = collector
+        self.interval = interval
+        self.jitter = interval if jitter is None else jitter
+        self.min_interval = min_interval
+        if state is None:
+            state = Manifest(os.path.join(default_cache_dir(), 'sites.json'))
+        self.state = state
+        self.racy_window = racy_window
+        self.uploads = 0
+        self._random = random.Random(seed)
+        # folders modification times of each site at its last check
+        self._signatures = {}
+
+    def _signature(self, paths):
+        signature = []
+        now = time.time()
+        for path in site_paths() if paths is None else paths:
+            try:
+                mtime = mtime_ns(os.stat(path))
+            except OSError:
+                mtime = None
+            if mtime is not None and is_racy(mtime, now, self.racy_window):
+                return None
+            signature.append((path, mtime))
+        return signature
+
+    def check(self, name, paths=None):
+        """Report the site ``name`` if its packages changed, return whether it was uploaded."""
+        signature = self._signature(paths)
+        if signature is not None and self._signatures.get(name) == signature:
+            log.debug('site %s: packages folders not modified', name)
+            return False
+        key = '%s %s/%s' % (self.api.base_url, self.repository, name)
+        body = collect(self.collector, paths)
+        current = packages(body)
+        last = self.state.get(key)
+        if last is not None and last['packages'] == current:
+            log.debug('site %s: packages not changed', name)
+            self._signatures[name] = signature
+            return False
+        now = time.time()
+        if last is not None and now - last['reported'] < self.min_interval:
+            log.info('site %s changed, reported at most every %ss', name, self.min_interval)
+            return False
+        self.api.update_site(self.repository, name, data=body)
+        self.uploads += 1
+        self.state.set(key, {'packages': current, 'reported': now})
+        self._signatures[name] = signature
+        if last is not None:
+            log.info('site %s: %d packages added, %d removed, %d changed', name,
+                     *[len(names) for names in diff(last['packages'], current)])
+        return True
+
+    def check_all(self):
+        for name, paths in sorted(self.sites.items()):
+            try:
+                self.check(name, paths)
+            except Exception as e:
+                # checked again next round
+                log.error('failed to report site %s: %s', name, e)
+
+    def delay(self):
+        return self.interval + self._random.uniform(0, self.jitter)
+
+    def run(self, stop=None, once=False):
+        """Check the sites every ``interval`` (plus jitter) seconds, until ``stop`` (a ``threading.Event``) is set."""
+        wait = stop.wait if stop is not None else time.sleep
+        wait(self._random.uniform(0, self.jitter))
+        while stop is None or not stop.is_set():
+            self.check_all()
+            if once:
+                return
+            wait(self.delay())
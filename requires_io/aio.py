@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""asyncio client for the requires.io API.
+
+Requires Python 3.6+ and aiohttp (``pip install requires.io[async]``).
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from requires_io.api import BaseAPI
+from requires_io.cache import digest_paths, digests_etag
+from requires_io.consts import NATIVE
+from requires_io.freeze import collect
+from requires_io.payload import COMPRESS_THRESHOLD, ReferencePayload
+
+log = logging.getLogger(__name__)
+
+_end = object()
+
+
+class AsyncRequiresAPI(BaseAPI):
+    """Same operations as :class:`~requires_io.api.RequiresAPI`, as coroutines.
+
+    Requests share one aiohttp session holding at most ``pool_maxsize``
+    connections. File reads and environment enumeration run in ``executor``
+    (the loop default executor when ``None``) so they never block the event
+    loop.
+    Use :meth:`gather` to run many operations with a bounded concurrency.
+    """
+
+    def __init__(self, token, base_url='https://requires.io/api/v2/', verify=True,
+                 session=None, pool_maxsize=10, concurrency=100, executor=None, manifest=None,
+                 compress=None, compress_threshold=COMPRESS_THRESHOLD, metrics=None):
+        super(AsyncRequiresAPI, self).__init__(token, base_url=base_url, verify=verify, manifest=manifest,
+                                               compress=compress, compress_threshold=compress_threshold,
+                                               metrics=metrics)
+        self.session = session
+        self.pool_maxsize = pool_maxsize
+        self.concurrency = concurrency
+        self.executor = executor
+
+    def _get_session(self):
+        if self.session is None:
+            kwargs = {} if self.verify else {'ssl': False}
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize, **kwargs)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def gather(self, *aws, limit=None, return_exceptions=False):
+        """Await all ``aws`` with at most ``limit`` (default: ``concurrency``) running at once."""
+        semaphore = asyncio.Semaphore(limit or self.concurrency)
+
+        async def run(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*[run(aw) for aw in aws], return_exceptions=return_exceptions)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _iterate(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            chunk = await self._run(next, iterator, _end)
+            if chunk is _end:
+                return
+            yield chunk
+
+    async def _request(self, method, url, **kwargs):
+        start = time.time()
+        self.metrics.add('requests')
+        try:
+            async with self._get_session().request(method, url, **kwargs) as response:
+                body = await response.read()
+        finally:
+            self.metrics.observe(time.time() - start)
+        self.metrics.add('bytes_received', len(body))
+        response.raise_for_status()
+        return body
+
+    async def _upload(self, method, url, headers, data):
+        # data is bytes, text or a (blocking) iterable of chunks, produced in the executor
+        compressed = self._compress(headers, data)
+        if compressed is not None:
+            try:
+                return await self._request(method, url, headers=compressed[0], data=self._iterate(compressed[1]))
+            except aiohttp.ClientResponseError as e:
+                if not self._reject_compression(e.status):
+                    raise
+        if not isinstance(data, (bytes, str)):
+            data = self._iterate(data)
+        return await self._request(method, url, headers=headers, data=data)
+
+    async def _update_reference(self, url, paths):
+        headers = self._get_headers()
+        digests = None
+        if self.manifest is not None:
+            digests = await self._run(digest_paths, paths)
+            if await self._run(self.manifest.get, url) == digests:
+                log.info('no change since last update, skip upload')
+                return
+            headers['If-None-Match'] = digests_etag(digests)
+        try:
+            await self._upload('PUT', url, headers, ReferencePayload(paths))
+        except aiohttp.ClientResponseError as e:
+            if digests is None or e.status != 412:
+                raise
+            log.info('no change on server, upload skipped')
+        if digests is not None:
+            await self._run(self.manifest.set, url, digests)
+
+    async def _forget_reference(self, url):
+        if self.manifest is not None:
+            await self._run(self.manifest.discard, url)
+
+    # =========================================================================
+    # REPOSITORY
+    # -------------------------------------------------------------------------
+    async def update_repository(self, repository, private):
+        payload = dict(
+            private=private,
+        )
+        await self._request(
+            'PUT',
+            self._get_repository_url(repository),
+            headers=self._get_headers(),
+            data=json.dumps(payload),
+        )
+
+    async def delete_repository(self, repository):
+        log.info('delete repository %s', repository)
+        await self._request(
+            'DELETE',
+            self._get_repository_url(repository),
+            headers=self._get_headers(),
+        )
+        await self._forget_reference(self._get_repository_url(repository))
+
+    # =========================================================================
+    # BRANCH
+    # -------------------------------------------------------------------------
+    async def update_branch(self, repository, name, paths):
+        log.info('update branch %s on repository %s', name, repository)
+        await self._update_reference(
+            self._get_branch_url(repository, name),
+            paths,
+        )
+
+    async def delete_branch(self, repository, name):
+        log.info('delete branch %s on repository %s', name, repository)
+        await self._request(
+            'DELETE',
+            self._get_branch_url(repository, name),
+            headers=self._get_headers(),
+        )
+        await self._forget_reference(self._get_branch_url(repository, name))
+
+    # =========================================================================
+    # TAG
+    # -------------------------------------------------------------------------
+    async def update_tag(self, repository, name, paths):
+        log.info('update tag %s on repository %s', name, repository)
+        await self._update_reference(
+            self._get_tag_url(repository, name),
+            paths,
+        )
+
+    async def delete_tag(self, repository, name):
+        log.info('delete tag %s on repository %s', name, repository)
+        await self._request(
+            'DELETE',
+            self._get_tag_url(repository, name),
+            headers=self._get_headers(),
+        )
+        await self._forget_reference(self._get_tag_url(repository, name))
+
+    # =========================================================================
+    # SITE
+    # -------------------------------------------------------------------------
+    async def update_site(self, repository, name, collector=NATIVE, paths=None, data=None):
+        log.info('update site %s on repository %s', name, repository)
+        if data is None:
+            data = await self._run(collect, collector, paths)
+        await self._upload(
+            'PUT',
+            self._get_site_url(repository, name),
+            self._get_headers('text/plain'),
+            data,
+        )
+
+    async def delete_site(self, repository, name):
+        log.info('delete site %s on repository %s', name, repository)
+        await self._request(
+            'DELETE',
+            self._get_site_url(repository, name),
+            headers=self._get_headers(),
+        )
+
+    # =========================================================================
+    # REQUIREMENTS
+    # -------------------------------------------------------------------------
+    async def get_requirements(self, file_path, file_type=None):
+        data = aiohttp.FormData()
+        for key, value in self._get_requirements_data(file_type).items():
+            data.add_field(key, value)
+
+        def read():
+            with open(file_path, 'rb') as fd:
+                return fd.read()
+
+        data.add_field('file', await self._run(read), filename=os.path.basename(file_path))
+        body = await self._request(
+            'POST',
+            self._get_requirements_url(),
+            data=data,
+            headers=self._get_headers(content_type=None),
+        )
+        return json.loads(body.decode('utf-8'))
@@ -1,40 +1,41 @@
 # -*- coding: utf-8 -*-
-import sys
 import json
-import base64
-import codecs
 import logging
-import subprocess
+import os
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+from requests.status_codes import codes
 
 from requires_io import consts
+from requires_io.cache import digest_paths, digests_etag
+from requires_io.consts import NATIVE
+from requires_io.freeze import check_output, collect, pip_freeze  # noqa: F401 (they used to be defined here)
+from requires_io.metrics import NullMetrics
+from requires_io.payload import (CHUNK_SIZE, COMPRESS_THRESHOLD, CompressedPayload, ReferencePayload, iter_json_array,
+                                 worth_compressing)
+from requires_io.scheduler import AIMDLimiter, Scheduler
+from requires_io.trace import NullTracer
 
 
 log = logging.getLogger(__name__)
 
-try:
-    check_output = subprocess.check_output
-except AttributeError:
-    def check_output(*args, **kwargs):
-        process = subprocess.Popen(stdout=subprocess.PIPE, *args, **kwargs)
-        output, unused_err = process.communicate()
-        code = process.poll()
-        if code:
-            cmd = kwargs.get('args')
-            if cmd is None:
-                cmd = args[0]
-            raise subprocess.CalledProcessError(code, cmd, output=output)
-        return output
-
-
-class RequiresAPI(object):
-    def __init__(self, token, base_url='https://requires.io/api/v2/', verify=True):
+
+class BaseAPI(object):
+    def __init__(self, token, base_url='https://requires.io/api/v2/', verify=True, manifest=None,
+                 compress=None, compress_threshold=COMPRESS_THRESHOLD, metrics=None, tracer=None):
         self.token = token
         self.base_url = base_url
         if self.base_url[-1] != '/':
             self.base_url += '/'
         self.verify = verify
+        self.manifest = manifest
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self.metrics = NullMetrics() if metrics is None else metrics
+        self.tracer = NullTracer() if tracer is None else tracer
 
     def _get_headers(self, content_type='application/json'):
         headers = {
@@ -45,53 +46,183 @@ class RequiresAPI(object):
             headers['Content-Type'] = content_type
         return headers
 
+    def _get_repository_url(self, repository):
+        return '%srepos/%s' % (self.base_url, repository)
+
+    def _get_branch_url(self, repository, name):
+        return '%s/branches/%s' % (self._get_repository_url(repository), name)
+
+    def _get_tag_url(self, repository, name):
+        return '%s/tags/%s' % (self._get_repository_url(repository), name)
+
+    def _get_site_url(self, repository, name):
+        return '%s/sites/%s' % (self._get_repository_url(repository), name)
+
+    def _get_requirements_url(self):
+        return self.base_url + 'requirements/'
+
+    def _get_packages_url(self):
+        return self.base_url + 'packages/'
+
+    def _get_requirements_data(self, file_type):
+        data = {}
+        if file_type:
+            if file_type not in consts.TYPES:
+                raise ValueError('invalid file type: %s' % file_type)
+            data['file_type'] = file_type
+        return data
+
+    def _forget_reference(self, url):
+        if self.manifest is not None:
+            self.manifest.discard(url)
+
+    def _compress(self, headers, data):
+        # Compressed (headers, data) of an upload, None when it is sent as is
+        if not self.compress or not worth_compressing(data, self.compress_threshold):
+            return None
+        headers = dict(headers)
+        headers['Content-Encoding'] = self.compress
+        return headers, CompressedPayload(data, self.compress)
+
+    def _reject_compression(self, status_code):
+        # The server does not decode compressed bodies: send them as is from now on
+        if status_code != codes.UNSUPPORTED_MEDIA_TYPE:
+            return False
+        log.warning('server does not accept %s request bodies, send them uncompressed', self.compress)
+        self.compress = None
+        return True
+
+
+class RequiresAPI(BaseAPI):
+    def __init__(self, token, base_url='https://requires.io/api/v2/', verify=True,
+                 session=None, pool_connections=10, pool_maxsize=10, pool_block=False, manifest=None,
+                 requirements_cache=None, compress=None, compress_threshold=COMPRESS_THRESHOLD, scheduler=None,
+                 metrics=None, tracer=None):
+        super(RequiresAPI, self).__init__(token, base_url=base_url, verify=verify, manifest=manifest,
+                                          compress=compress, compress_threshold=compress_threshold, metrics=metrics,
+                                          tracer=tracer)
+        if session is None:
+            session = self._create_session(pool_connections, pool_maxsize, pool_block)
+        self.session = session
+        if scheduler is None:
+            # Retry idempotent calls and back off on overload, never above the size of the pool
+            scheduler = Scheduler(limiter=AIMDLimiter(maximum=pool_maxsize))
+        self.scheduler = scheduler
+        self.requirements_cache = requirements_cache
+
+    def _create_session(self, pool_connections, pool_maxsize, pool_block):
+        # One keep-alive pool for all the calls. The session can be shared between threads as
+        # calls never mutate it (headers and verify are passed per request); set pool_block to
+        # make extra threads wait for a free connection instead of opening new ones.
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('verify', self.verify)
+        if 'data' in kwargs:
+            kwargs['data'] = self.metrics.stream(kwargs['data'])
+        attempts = []
+
+        def send():
+            attempts.append(time.time())
+            try:
+                with self.tracer.span('%s %s' % (method, url[len(self.base_url):]), cat='http', attempt=len(attempts)):
+                    response = self.session.request(method, url, **kwargs)
+            finally:
+                self.metrics.observe(time.time() - attempts[-1])
+            if not kwargs.get('stream'):
+                self.metrics.add('bytes_received', len(response.content))
+            return response
+
+        try:
+            response = self.scheduler.call(method, url, send)
+        finally:
+            self.metrics.add('requests', len(attempts))
+            self.metrics.add('retries', max(0, len(attempts) - 1))
+        response.raise_for_status()
+        return response
+
+    def _upload(self, method, url, headers, data):
+        compressed = self._compress(headers, data)
+        if compressed is not None:
+            try:
+                return self._request(method, url, headers=compressed[0], data=compressed[1])
+            except HTTPError as e:
+                if not self._reject_compression(e.response.status_code):
+                    raise
+        return self._request(method, url, headers=headers, data=data)
+
     def _update_reference(self, url, paths):
-        payload = []
-        for path, relative in paths.items():
-            log.info('add %s to payload', relative)
-            with open(path, 'rb') as f:
-                payload.append({
-                    'path': relative,
-                    'content': base64.b64encode(f.read()).decode('utf-8'),
-                })
-        requests.put(
-            url,
-            headers=self._get_headers(),
-            data=json.dumps(payload),
-            verify=self.verify,
-        ).raise_for_status()
+        headers = self._get_headers()
+        digests = None
+        if self.manifest is not None:
+            with self.metrics.phase('digest'):
+                digests = digest_paths(paths)
+            if self.manifest.get(url) == digests:
+                log.info('no change since last update, skip upload')
+                return
+            # let the server skip the update too if it already has this content
+            headers['If-None-Match'] = digests_etag(digests)
+        payload = ReferencePayload(paths, span=self.tracer.span if self.tracer.enabled else None)
+        try:
+            # The payload is an iterable: requests streams it with a chunked transfer encoding
+            self._upload(
+                'PUT',
+                url,
+                headers=headers,
+                data=payload,
+            )
+        except HTTPError as e:
+            if digests is None or e.response.status_code != codes.PRECONDITION_FAILED:
+                raise
+            log.info('no change on server, upload skipped')
+        finally:
+            self.metrics.add('bytes_read', payload.bytes_read)
+        if digests is not None:
+            self.manifest.set(url, digests)
 
     # =========================================================================
     # REPOSITORY
     # -------------------------------------------------------------------------
-    def _get_repository_url(self, repository):
-        return '%srepos/%s' % (self.base_url, repository)
-
     def update_repository(self, repository, private):
         payload = dict(
             private=private,
         )
-        requests.put(
+        self._request(
+            'PUT',
             self._get_repository_url(repository),
             headers=self._get_headers(),
             data=json.dumps(payload),
-            verify=self.verify,
-        ).raise_for_status()
+        )
 
     def delete_repository(self, repository):
         log.info('delete repository %s', repository)
-        requests.delete(
+        self._request(
+            'DELETE',
             self._get_repository_url(repository),
             headers=self._get_headers(),
-            verify=self.verify,
-        ).raise_for_status()
+        )
+        self._forget_reference(self._get_repository_url(repository))
 
     # =========================================================================
     # BRANCH
     # -------------------------------------------------------------------------
-    def _get_branch_url(self, repository, name):
-        return '%s/branches/%s' % (self._get_repository_url(repository), name)
-
     def update_branch(self, repository, name, paths):
         log.info('update branch %s on repository %s', name, repository)
         return self._update_reference(
@@ -101,18 +232,16 @@ class RequiresAPI(object):
 
     def delete_branch(self, repository, name):
         log.info('delete branch %s on repository %s', name, repository)
-        requests.delete(
+        self._request(
+            'DELETE',
             self._get_branch_url(repository, name),
             headers=self._get_headers(),
-            verify=self.verify,
-        ).raise_for_status()
+        )
+        self._forget_reference(self._get_branch_url(repository, name))
 
     # =========================================================================
     # TAG
     # -------------------------------------------------------------------------
-    def _get_tag_url(self, repository, name):
-        return '%s/tags/%s' % (self._get_repository_url(repository), name)
-
     def update_tag(self, repository, name, paths):
         log.info('update tag %s on repository %s', name, repository)
         return self._update_reference(
@@ -122,55 +251,109 @@ class RequiresAPI(object):
 
     def delete_tag(self, repository, name):
         log.info('delete tag %s on repository %s', name, repository)
-        requests.delete(
+        self._request(
+            'DELETE',
             self._get_tag_url(repository, name),
             headers=self._get_headers(),
-            verify=self.verify,
-        ).raise_for_status()
+        )
+        self._forget_reference(self._get_tag_url(repository, name))
 
     # =========================================================================
     # SITE
     # -------------------------------------------------------------------------
-    def _get_site_url(self, repository, name):
-        return '%s/sites/%s' % (self._get_repository_url(repository), name)
-
-    def update_site(self, repository, name):
+    def update_site(self, repository, name, collector=NATIVE, paths=None, data=None):
+        """Report the packages installed in ``paths`` (default: this environment), or ``data`` if given."""
         log.info('update site %s on repository %s', name, repository)
-        command = ['pip', 'freeze', '--local']
-        output = check_output(command)
-        encoding = getattr(sys.stdout, 'encoding', 'utf-8')
-        data = codecs.decode(output, encoding, 'replace')
-        requests.put(
+        self._upload(
+            'PUT',
             self._get_site_url(repository, name),
             headers=self._get_headers('text/plain'),
-            data=data,
-            verify=self.verify,
-        ).raise_for_status()
+            data=collect(collector, paths) if data is None else data,
+        )
 
     def delete_site(self, repository, name):
         log.info('delete site %s on repository %s', name, repository)
-        requests.delete(
+        self._request(
+            'DELETE',
             self._get_site_url(repository, name),
             headers=self._get_headers(),
-            verify=self.verify,
-        ).raise_for_status()
+        )
 
     # =========================================================================
     # REQUIREMENTS
     # -------------------------------------------------------------------------
-    def get_requirements(self, file_path, file_type=None):
-        data = {}
-        if file_type:
-            if file_type not in consts.TYPES:
-                raise ValueError('invalid file type: %s' % file_type)
-            data['file_type'] = file_type
+    def get_requirements(self, file_path, file_type=None, stream=False):
+        """Requirements of the file, as a list.
+
+        With ``stream``, return an iterator instead: the file is sent when
+        it is first advanced and requirements are yielded one by one as the
+        response arrives.
+        """
+        if stream:
+            return self._iter_requirements(file_path, file_type)
+        data = self._get_requirements_data(file_type)
+        cache = self.requirements_cache
+        if cache is not None:
+            key = cache.key(self.base_url, file_path, file_type)
+            requirements = cache.get(key)
+            if requirements is not None:
+                log.debug('requirements of %s found in cache', file_path)
+                return requirements
         with open(file_path, 'rb') as fd:
-            response = requests.post(
-                self.base_url + 'requirements/',
-                files={'file': fd},
-                data=data,
-                headers=self._get_headers(content_type=None),
-                verify=self.verify,
-            )
-            response.raise_for_status()
-            return response.json()
+            response = self._post_requirements(fd, data)
+            requirements = response.json()
+        if cache is not None:
+            cache.set(key, requirements)
+        return requirements
+
+    def _post_requirements(self, fd, data, stream=False):
+        self.metrics.add('bytes_read', os.fstat(fd.fileno()).st_size)
+        return self._request(
+            'POST',
+            self._get_requirements_url(),
+            files={'file': fd},
+            data=data,
+            headers=self._get_headers(content_type=None),
+            stream=stream,
+        )
+
+    def _iter_content(self, response):
+        for chunk in response.iter_content(CHUNK_SIZE):
+            self.metrics.add('bytes_received', len(chunk))
+            yield chunk
+
+    def _iter_requirements(self, file_path, file_type):
+        data = self._get_requirements_data(file_type)
+        cache = self.requirements_cache
+        requirements = None
+        if cache is not None:
+            key = cache.key(self.base_url, file_path, file_type)
+            requirements = cache.get(key)
+            if requirements is not None:
+                log.debug('requirements of %s found in cache', file_path)
+                for requirement in requirements:
+                    yield requirement
+                return
+            requirements = []
+        with open(file_path, 'rb') as fd:
+            response = self._post_requirements(fd, data, stream=True)
+        try:
+            for requirement in iter_json_array(self._iter_content(response), response.encoding or 'utf-8'):
+                if requirements is not None:
+                    requirements.append(requirement)
+                yield requirement
+        finally:
+            response.close()
+        if cache is not None:
+            cache.set(key, requirements)
+
+    # =========================================================================
+    # PACKAGES
+    # -------------------------------------------------------------------------
+    def get_packages(self):
+        """Releases of each known package, from servers dumping them such as ``requires_io.server``."""
+        return self._request(
+            'GET',
+            self._get_packages_url(),
+            headers=self._get_headers(content_type=None),
+        ).json()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+log = logging.getLogger(__name__)
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def default_cache_dir():
+    path = os.getenv('REQUIRES_CACHE_DIR')
+    if not path:
+        root = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(root, 'requires.io')
+    return path
+
+
+def write_atomic(path, data):
+    import tempfile
+
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        _replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on ``path`` (created if needed) across processes."""
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def file_digest(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def digest_paths(paths):
+    return dict((relative, file_digest(path)) for path, relative in paths.items())
+
+
+def digests_etag(digests):
+    digest = hashlib.sha256()
+    for relative, value in sorted(digests.items()):
+        digest.update(('%s\0%s\n' % (relative, value)).encode('utf-8'))
+    return '"%s"' % digest.hexdigest()
+
+
+class Manifest(object):
+    """Digests of the files last uploaded for each branch or tag.
+
+    References are keyed by their API URL and map the relative path of each
+    uploaded file to its SHA-256. The manifest is stored as a JSON file,
+    rewritten atomically; updates are serialized across threads and processes
+    so that concurrent writers do not lose each other's entries.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(default_cache_dir(), 'manifest.json')
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # the manifest is replaced on each write: lock a file next to it
+        with self._lock, file_lock(self.path + '.lock'):
+            yield
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return json.loads(f.read().decode('utf-8')).get('references', {})
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, references):
+        data = json.dumps({'references': references}, indent=1, sort_keys=True)
+        write_atomic(self.path, data.encode('utf-8'))
+
+    def get(self, key):
+        with self._locked():
+            return self._load().get(key)
+
+    def set(self, key, digests):
+        with self._locked():
+            references = self._load()
+            references[key] = digests
+            self._save(references)
+
+    def discard(self, prefix):
+        with self._locked():
+            references = self._load()
+            keys = [key for key in references if key == prefix or key.startswith(prefix + '/')]
+            if keys:
+                for key in keys:
+                    del references[key]
+                self._save(references)
+
+
+class RequirementsCache(object):
+    """Parsed requirements, keyed by the digest of the parsed file.
+
+    Each entry is a JSON file written atomically, so lookups need no lock.
+    Entries expire ``ttl`` seconds after they were stored and the least
+    recently used ones are evicted once the cache exceeds ``max_size`` bytes,
+    as tracked by a running total kept next to the entries; writes and
+    evictions are serialized across processes by a file lock.
+    """
+
+    def __init__(self, path=None, ttl=3600, max_size=64 * 1024 * 1024):
+        if path is None:
+            path = os.path.join(default_cache_dir(), 'requirements')
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def key(self, base_url, file_path, file_type=None):
+        value = '%s\0%s\0%s' % (base_url, file_type or '', file_digest(file_path))
+        return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            entry = json.loads(entry.decode('utf-8'))
+            if entry['created'] + self.ttl < time.time():
+                return None
+            data = entry['data']
+        except (ValueError, KeyError, TypeError):
+            # not written by set: a miss, and no need to keep it
+            log.warning('removing invalid cache entry %s', path)
+            self._remove(path)
+            return None
+        try:
+            # the modification time tracks the last use for the eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _remove(self, path):
+        with file_lock(os.path.join(self.path, '.lock')):
+            size, scanned = self._load_index()
+            try:
+                removed = os.path.getsize(path)
+                os.unlink(path)
+            except OSError:  # removed by another process
+                return
+            if size is not None:
+                self._save_index(max(0, size - removed), scanned)
+
+    def _load_index(self):
+        # running total of the entries size, and time of the last scan of the folder
+        try:
+            with open(os.path.join(self.path, '.index'), 'rb') as f:
+                index = json.loads(f.read().decode('utf-8'))
+            return int(index['size']), float(index['scanned'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def _save_index(self, size, scanned):
+        write_atomic(os.path.join(self.path, '.index'), json.dumps({'size': size, 'scanned': scanned}).encode('utf-8'))
+
+    def set(self, key, data):
+        entry = json.dumps({'created': time.time(), 'data': data}).encode('utf-8')
+        path = self._entry_path(key)
+        with file_lock(os.path.join(self.path, '.lock')):
+            size, scanned = self._load_index()
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            write_atomic(path, entry)
+            now = time.time()
+            if size is not None:
+                size += len(entry) - replaced
+            # the folder is only listed when the entries may exceed max_size, or
+            # once per time to live to remove the expired ones
+            if size is None or size > self.max_size or scanned + self.ttl < now:
+                size, scanned = self._evict(path), now
+            self._save_index(size, scanned)
+
+    def _evict(self, keep):
+        """Remove the expired entries and the least recently used ones above ``max_size``, return the size left."""
+        now = time.time()
+        entries = []
+        size = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if not name.endswith('.json') or path == keep:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime + self.ttl < now:
+                # not used within the time to live: expired for sure
+                os.unlink(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            size += stat.st_size
+        entries.sort()
+        size += os.path.getsize(keep)
+        while size > self.max_size and entries:
+            unused_mtime, entry_size, path = entries.pop(0)
+            os.unlink(path)
+            size -= entry_size
+        return size
@@ -4,12 +4,15 @@ import glob
 import logging
 import os
 import re
-import socket
 import sys
+import threading
+import time
 
 from requires_io import __version__, consts
-from requires_io.api import RequiresAPI
-from requires_io.draw import draw
+from requires_io.consts import COLLECTORS, DISCOVERY_MODES, ENCODINGS, GIT, NATIVE, WALK, glob_type_re  # noqa: F401
+from requires_io.draw import FORMATS, JSONL, TABLE, draw, write_header, write_jsonl, write_rows
+from requires_io.metrics import FORMATS as METRICS_FORMATS, JSON, Metrics, NullMetrics
+from requires_io.trace import NullTracer, Tracer
 
 log = logging.getLogger(__name__)
 
@@ -29,6 +32,17 @@ class NameType(object):
         return value
 
 
+class WorkersType(object):
+    def __call__(self, value):
+        try:
+            workers = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid number: %s' % value)
+        if workers < 1:
+            raise argparse.ArgumentTypeError('at least 1 worker required')
+        return workers
+
+
 class TokenType(object):
     def __call__(self, value):
         if not value:
@@ -36,46 +50,53 @@ class TokenType(object):
         return value
 
 
-glob_type_re = re.compile(r'''
-   [/\\](
-   setup\.py
-   |tox\.ini
-   |(buildout|versions)\.cfg
-   |(req|pip|dep)[\w-]*\.(txt|pip)
-   |requirements[/\\][\w-]*\.(pip|txt)
-   )$
-''', re.X | re.IGNORECASE)
+def _traced_scan(tracer):
+    # discovery hook adding a span for each folder listed
+    def hook(scan):
+        def traced(folder):
+            with tracer.span('scan %s' % os.path.basename(folder), cat='discovery', folder=folder):
+                return scan(folder)
+        return traced
+    return hook
 
 
 class GlobType(object):
+    def __init__(self, workers=None, mode=WALK, cache=None, tracer=None):
+        self.workers = workers
+        self.mode = mode
+        self.cache = cache
+        self.tracer = NullTracer() if tracer is None else tracer
+
+    def find(self, folder):
+        """Known files in ``folder``, as found by the discovery mode."""
+        from requires_io.discovery import DEFAULT_WORKERS, discover, discover_git
+
+        found = None
+        if self.mode == GIT:
+            with self.tracer.span('git ls-files', cat='discovery', folder=folder):
+                found = discover_git(folder)
+        if found is None:
+            hook = _traced_scan(self.tracer) if self.tracer.enabled else None
+            found = discover(folder, self.workers or DEFAULT_WORKERS, self.cache, hook)
+        return found
+
     def __call__(self, value):
+        from requires_io.discovery import match
+
         paths = {}
         for path in glob.glob(os.path.normpath(os.path.abspath(value))):
             # If this is a folder, look for known files in it
             if os.path.isdir(path):
-                for root, dirs, files in os.walk(path):
-                    # Go threw the files to check if they match a known pattern
-                    for name in files:
-                        self._store(paths, os.path.join(root, name))
-                    # Ignore CVS folders
-                    if 'CVS' in dirs:
-                        dirs.remove('CVS')
-                    # Ignore hidden folders
-                    ignores = [d for d in dirs if d.startswith('.')]
-                    for ignore in ignores:
-                        dirs.remove(ignore)
+                paths.update(self.find(path))
             # If this is a file, add it if matches the pattern
             elif os.path.isfile(path):
-                self._store(paths, path)
+                relative = match(path)
+                if relative:
+                    paths[path] = relative
         if not paths:
             raise argparse.ArgumentTypeError('failed to find requirement files matching the pattern for %s' % value)
         return paths
 
-    def _store(self, paths, path):
-        match = glob_type_re.search(path)
-        if match:
-            paths[path] = match.group(1)
-
 
 class PathType(object):
     def __call__(self, value):
@@ -84,6 +105,28 @@ class PathType(object):
         return value
 
 
+class FilesType(object):
+    def __init__(self, mode=WALK, cache=None, tracer=None):
+        self.glob_type = GlobType(mode=mode, cache=cache, tracer=tracer)
+
+    def __call__(self, value):
+        files = []
+        for path in sorted(glob.glob(value)):
+            # If this is a folder, look for known files in it
+            if os.path.isdir(path):
+                files.extend(sorted(self.glob_type.find(os.path.abspath(path))))
+            elif os.path.isfile(path):
+                files.append(path)
+        if not files:
+            raise argparse.ArgumentTypeError('file does not exist: %s' % value)
+        return files
+
+
+def _site_name(value):
+    # keep the characters allowed by NameType
+    return re.sub(r'[^a-zA-Z0-9-_\.]', '-', value)[:NameType().max_length]
+
+
 def _common_index(paths):
     index = 0
     for parts in zip(*[os.path.normcase(path).split(os.sep) for path in paths]):
@@ -111,10 +154,30 @@ def _to_urls(*all_paths):
     return urls
 
 
+class _LineWriter(object):
+    # stream shared by threads, each write being a whole line
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        with self.lock:
+            self.stream.write(line)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+
 class Commands(object):
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='requires.io')
         self.parser.add_argument('--version', action='version', version=__version__)
+        self.parser.add_argument('--trace', metavar='PATH',
+                                 help='write a timeline of the run to this file (Chrome trace events, '
+                                      'for Perfetto or chrome://tracing)')
+        self.metrics = NullMetrics()
+        self.tracer = NullTracer()
         self.subparsers = self.parser.add_subparsers()
         self.add_parser_update_repository()
         self.add_parser_delete_repository()
@@ -123,22 +186,93 @@ class Commands(object):
         self.add_parser_update_tag()
         self.add_parser_delete_tag()
         self.add_parser_update_site()
+        self.add_parser_site_agent()
         self.add_parser_delete_site()
+        self.add_parser_sync()
+        self.add_parser_watch()
         self.add_parser_parse()
+        self.add_parser_refresh_index()
+
+    def add_argument_discovery(self, group):
+        group.add_argument('--discovery', choices=DISCOVERY_MODES, default=WALK,
+                           help='how to find requirement files in folders: walk the file system or list the '
+                                'files tracked by git, walking folders outside of a git work tree (default: walk)')
+        group.add_argument('--discovery-cache', action='store_true',
+                           help='only list again the folders modified since the last run '
+                                '(folders are cached in REQUIRES_CACHE_DIR, default: ~/.cache/requires.io)')
 
     def add_argument_paths(self, group):
-        group.add_argument('paths', metavar='PATH', type=GlobType(), nargs='+',
+        self.add_argument_discovery(group)
+        group.add_argument('paths', metavar='PATH', nargs='+',
                            help='requirement files or folders containing requirement files (glob allowed)')
 
+    def discover(self, args):
+        try:
+            return self.discover_paths(args)
+        except argparse.ArgumentTypeError as e:
+            args.command_parser.error('argument PATH: %s' % e)
+
+    def discover_paths(self, args):
+        from requires_io.discovery import DiscoveryCache
+
+        # Paths are resolved once all the arguments are known, as they depend on --discovery
+        glob_type = GlobType(mode=args.discovery, cache=DiscoveryCache() if args.discovery_cache else None,
+                             tracer=self.tracer)
+        with self.metrics.phase('discovery'):
+            found = [glob_type(path) for path in args.paths]
+        with self.metrics.phase('mapping'):
+            return _to_urls(*found)
+
     def add_parser(self, title, help, executor):
         parser = self.subparsers.add_parser(title, help=help)
         group = parser.add_argument_group('global options')
         group.add_argument('-t', '--token',
                            help='API token (default: REQUIRES_TOKEN environment variable)',
                            type=TokenType(), default=os.getenv('REQUIRES_TOKEN'))
-        parser.set_defaults(execute=lambda args: executor(RequiresAPI(args.token), args))
+        group.add_argument('--api-url', metavar='URL',
+                           help='API base URL (default: REQUIRES_API_URL environment variable or %(default)s)',
+                           default=os.getenv('REQUIRES_API_URL', 'https://requires.io/api/v2/'))
+        group.add_argument('--metrics', choices=METRICS_FORMATS,
+                           help='report the duration of each phase, the bytes read and sent, the request '
+                                'latencies and the retries of the run in this format')
+        group.add_argument('--metrics-output', metavar='PATH', default='-',
+                           help='file the metrics are written to, atomically so that it can be read by the '
+                                'Prometheus textfile collector (default: standard error)')
+        group.add_argument('--retries', type=int, default=5,
+                           help='retries of updates and deletions on throttling and server errors (default: 5)')
+        # the handlers (and what they import) are only loaded when the command runs
+        parser.set_defaults(execute=lambda args: executor(self.create_api(args), args), command_parser=parser,
+                            command=title)
         return parser.add_argument_group('command options')
 
+    def create_api(self, args):
+        if getattr(args, 'offline', False):
+            # parsed locally: no client, and requests is not even imported
+            return None
+        # requests and the caches are only imported when a command actually runs
+        from requires_io.api import RequiresAPI
+        from requires_io.cache import Manifest, RequirementsCache
+        from requires_io.scheduler import AIMDLimiter, RetryPolicy, Scheduler
+
+        manifest = Manifest() if getattr(args, 'skip_unchanged', False) else None
+        requirements_cache = RequirementsCache(ttl=args.cache_ttl) if getattr(args, 'cache', False) else None
+        pool_maxsize = max(10, getattr(args, 'workers', 1))
+        scheduler = Scheduler(RetryPolicy(retries=args.retries), AIMDLimiter(maximum=pool_maxsize))
+        return RequiresAPI(args.token, base_url=args.api_url, manifest=manifest,
+                           requirements_cache=requirements_cache, pool_maxsize=pool_maxsize,
+                           compress=getattr(args, 'compress', None), scheduler=scheduler, metrics=self.metrics,
+                           tracer=self.tracer)
+
+    def add_argument_skip_unchanged(self, group):
+        group.add_argument('--skip-unchanged', action='store_true',
+                           help='do not upload files identical to the last update from this host '
+                                '(digests are kept in REQUIRES_CACHE_DIR, default: ~/.cache/requires.io)')
+
+    def add_argument_compress(self, group):
+        group.add_argument('--compress', choices=ENCODINGS,
+                           help='compress uploads of more than 1KB with this encoding, falling back to '
+                                'uncompressed uploads if the server does not support it')
+
     def add_repository_parser(self, *args, **kwargs):
         group = self.add_parser(*args, **kwargs)
         group.add_argument('-r', '--repository', metavar='REPO',
@@ -147,11 +281,38 @@ class Commands(object):
         return group
 
     def execute(self, args):
+        start = time.time()
         args = self.parser.parse_args(args)
         if not hasattr(args, 'execute'):
             self.parser.print_usage()
+            return
+        if args.metrics:
+            self.metrics = Metrics()
+            # paths of the parse command are discovered while the arguments are parsed
+            self.metrics.add_phase('arguments', time.time() - start)
+        if args.trace:
+            self.tracer = Tracer(origin=start)
+            self.tracer.add('parse arguments', start, time.time(), cat='cli')
+        try:
+            with self.tracer.span(args.command, cat='cli'):
+                args.execute(args)
+        finally:
+            if args.metrics:
+                self.write_metrics(args)
+            if args.trace:
+                self.tracer.write(args.trace)
+
+    def write_metrics(self, args):
+        from requires_io.cache import write_atomic
+
+        if args.metrics == JSON:
+            report = self.metrics.to_json()
+        else:
+            report = self.metrics.to_prometheus()
+        if args.metrics_output == '-':
+            sys.stderr.write(report)
         else:
-            args.execute(args)
+            write_atomic(os.path.abspath(args.metrics_output), report.encode('utf-8'))
 
     # =========================================================================
     # REPOSITORY
@@ -176,8 +337,10 @@ class Commands(object):
     def add_parser_update_branch(self):
         group = self.add_repository_parser('update-branch', 'create or update branch',
                                            lambda api, args: api.update_branch(args.repository, args.name,
-                                                                               _to_urls(*args.paths)))
+                                                                               self.discover(args)))
         self.add_argument_branch_name(group)
+        self.add_argument_skip_unchanged(group)
+        self.add_argument_compress(group)
         self.add_argument_paths(group)
 
     def add_parser_delete_branch(self):
@@ -194,8 +357,10 @@ class Commands(object):
     def add_parser_update_tag(self):
         group = self.add_repository_parser('update-tag', 'create or update tag',
                                            lambda api, args: api.update_tag(args.repository, args.name,
-                                                                            _to_urls(*args.paths)))
+                                                                            self.discover(args)))
         self.add_argument_tag_name(group)
+        self.add_argument_skip_unchanged(group)
+        self.add_argument_compress(group)
         self.add_argument_paths(group)
 
     def add_parser_delete_tag(self):
@@ -207,29 +372,340 @@ class Commands(object):
     # SITE
     # -------------------------------------------------------------------------
     def add_argument_site_name(self, group):
-        group.add_argument('-n', '--name', help='site name (default: %s)' % socket.gethostname(),
-                           type=NameType(), default=socket.gethostname())
+        group.add_argument('-n', '--name', help='site name (default: host name)', type=NameType())
 
-    def add_parser_update_site(self):
-        group = self.add_repository_parser('update-site', 'create or update site',
-                                           lambda api, args: api.update_site(args.repository, args.name))
+    def site_name(self, args):
+        if args.name is None:
+            import socket
+
+            try:
+                args.name = NameType()(socket.gethostname())
+            except argparse.ArgumentTypeError as e:
+                args.command_parser.error('argument -n/--name: invalid host name: %s' % e)
+        return args.name
+
+    def add_argument_sites(self, group):
         self.add_argument_site_name(group)
+        group.add_argument('--collector', choices=COLLECTORS, default=NATIVE,
+                           help='how to list the installed packages: read their metadata in process or run '
+                                '"pip freeze --local" (default: native, falling back to pip if nothing is found)')
+        group.add_argument('-e', '--env', dest='envs', metavar='PATH', action='append', default=[],
+                           help='report this virtualenv (interpreter, virtualenv or site-packages folder) '
+                                'as the site NAME-ENV instead of the current environment (repeatable)')
+        group.add_argument('--envs-root', metavar='ROOT', action='append', default=[],
+                           help='report all the virtualenvs found in this folder, like --env (repeatable)')
+
+    def sites(self, args):
+        """Site paths of each site to report, ``None`` for the current environment."""
+        from requires_io.freeze import environment, find_environments
+
+        envs = list(args.envs)
+        for root in args.envs_root:
+            envs.extend(find_environments(root))
+        if not envs:
+            if args.envs_root:
+                args.command_parser.error('no virtualenv found in %s' % ', '.join(args.envs_root))
+            return {self.site_name(args): None}
+        if args.collector != NATIVE:
+            args.command_parser.error('--collector %s can not report other environments' % args.collector)
+        sites = {}
+        for env in envs:
+            root, paths = environment(env)
+            if not paths:
+                args.command_parser.error('no site-packages folder found for %s' % env)
+            name = _site_name('%s-%s' % (self.site_name(args), os.path.basename(root)))
+            if name in sites:
+                args.command_parser.error('several virtualenvs would be reported as the site %s' % name)
+            sites[name] = paths
+        return sites
+
+    def add_parser_update_site(self):
+        group = self.add_repository_parser('update-site', 'create or update site', self.update_site)
+        self.add_argument_sites(group)
+        group.add_argument('-j', '--workers', type=WorkersType(), default=8,
+                           help='number of virtualenvs reported concurrently (default: 8)')
+        self.add_argument_compress(group)
+
+    def update_site(self, api, args):
+        from concurrent.futures import ThreadPoolExecutor
+
+        sites = self.sites(args)
+        if list(sites.values()) == [None]:
+            return api.update_site(args.repository, self.site_name(args), args.collector)
+
+        def update(item):
+            name, paths = item
+            try:
+                api.update_site(args.repository, name, paths=paths)
+            except Exception as e:
+                log.error('failed to update site %s: %s', name, e)
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(update, sorted(sites.items())))
+        if not all(results):
+            sys.exit(1)
+
+    def add_parser_site_agent(self):
+        group = self.add_repository_parser('site-agent', 'keep reporting sites, uploading them when their '
+                                                         'packages change', self.site_agent)
+        self.add_argument_sites(group)
+        group.add_argument('--interval', metavar='SECONDS', type=float, default=300,
+                           help='check for changes every SECONDS (default: 300)')
+        group.add_argument('--jitter', metavar='SECONDS', type=float,
+                           help='wait up to SECONDS more, at random, before each check and the first one '
+                                '(default: the interval)')
+        group.add_argument('--min-interval', metavar='SECONDS', type=float, default=900,
+                           help='upload a site at most once every SECONDS (default: 900)')
+        group.add_argument('--once', action='store_true',
+                           help='check once, after the random delay, and exit (to run from cron)')
+        self.add_argument_compress(group)
+
+    def site_agent(self, api, args):
+        from requires_io.agent import SiteAgent
+
+        agent = SiteAgent(api, args.repository, self.sites(args), collector=args.collector, interval=args.interval,
+                          jitter=args.jitter, min_interval=args.min_interval)
+        try:
+            agent.run(once=args.once)
+        except KeyboardInterrupt:
+            pass
 
     def add_parser_delete_site(self):
         group = self.add_repository_parser('delete-site', 'delete site',
-                                           lambda api, args: api.delete_site(args.repository, args.name))
+                                           lambda api, args: api.delete_site(args.repository, self.site_name(args)))
         self.add_argument_site_name(group)
 
+    # =========================================================================
+    # SYNC
+    # -------------------------------------------------------------------------
+    def add_parser_sync(self):
+        group = self.add_parser('sync', 'apply all the updates described by a manifest file', self.sync)
+        group.add_argument('-j', '--workers', type=WorkersType(), default=8,
+                           help='number of operations running concurrently (default: 8)')
+        self.add_argument_skip_unchanged(group)
+        self.add_argument_compress(group)
+        self.add_argument_discovery(group)
+        group.add_argument('manifest', metavar='MANIFEST', type=PathType(),
+                           help='JSON file describing repositories, branches, tags and sites')
+
+    def sync(self, api, args):
+        from requires_io import sync
+        try:
+            stages = sync.load_manifest(args.manifest, discovery=args.discovery, discovery_cache=args.discovery_cache)
+        except ValueError as e:
+            args.command_parser.error('invalid manifest %s: %s' % (args.manifest, e))
+        results = sync.run(api, stages, workers=args.workers)
+        if not all(result.ok for result in results):
+            sys.exit(1)
+
+    # =========================================================================
+    # WATCH
+    # -------------------------------------------------------------------------
+    def add_parser_watch(self):
+        group = self.add_repository_parser('watch', 'update a branch whenever its requirement files change',
+                                           self.watch)
+        self.add_argument_branch_name(group)
+        group.add_argument('--debounce', metavar='SECONDS', type=float, default=2.0,
+                           help='wait for changes to stop for SECONDS before updating the branch (default: 2)')
+        group.add_argument('--poll', metavar='SECONDS', type=float,
+                           help='list the requirement files every SECONDS to find changes instead of being notified '
+                                'of them (default: notified by inotify when available)')
+        self.add_argument_compress(group)
+        self.add_argument_paths(group)
+
+    def watch(self, api, args):
+        from requires_io.cache import digest_paths
+        from requires_io.watch import batches, create_watcher
+
+        roots = []
+        for pattern in args.paths:
+            roots.extend(glob.glob(os.path.normpath(os.path.abspath(pattern))))
+        paths = self.discover(args)
+        api.update_branch(args.repository, args.name, paths)
+        digests = digest_paths(paths)
+        watcher = create_watcher(roots, args.poll, args.discovery)
+        log.info('branch %s updated, watching %d requirement files', args.name, len(paths))
+        try:
+            for changed in batches(watcher, args.debounce):
+                try:
+                    paths = self.discover_paths(args)
+                except argparse.ArgumentTypeError as e:
+                    log.warning('%s, branch %s not updated', e, args.name)
+                    continue
+                current = digest_paths(paths)
+                if current == digests:
+                    log.debug('%d paths changed, but no requirement file', len(changed))
+                    continue
+                try:
+                    api.update_branch(args.repository, args.name, paths)
+                except Exception as e:
+                    # keep the previous digests to try again on the next change
+                    log.error('failed to update branch %s: %s', args.name, e)
+                else:
+                    digests = current
+                    log.info('branch %s updated with %d requirement files', args.name, len(paths))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
     # =========================================================================
     # REQUIREMENTS
     # -------------------------------------------------------------------------
     def add_parser_parse(self):
-        group = self.add_parser('parse', 'parse provided requirements file',
-                                lambda api, args: draw(api.get_requirements(args.paths[0], args.file_type)))
+        group = self.add_parser('parse', 'parse provided requirements files', self.parse)
         group.add_argument('-k', '--kind', dest='file_type', choices=consts.TYPES,
                            help='type of requirements file (default: let us guess from file name)')
-        group.add_argument('paths', metavar='PATH', type=PathType(), nargs=1,
-                           help='requirements file to process')
+        group.add_argument('-j', '--workers', type=WorkersType(), default=8,
+                           help='number of files parsed concurrently (default: 8)')
+        group.add_argument('--ordered', action='store_true',
+                           help='print the results in the order of the paths instead of as soon as they arrive')
+        group.add_argument('-f', '--format', choices=FORMATS, default=TABLE,
+                           help='output format: a table per file, or a JSON object, CSV or TSV line per requirement '
+                                '(default: table)')
+        group.add_argument('--column-width', metavar='WIDTH', type=int,
+                           help='write table rows as they come, in columns of WIDTH characters (longer values are '
+                                'truncated) instead of fitting the columns to the content')
+        group.add_argument('--offline', action='store_true',
+                           help='parse the files locally, following their includes, without sending them '
+                                '(latest versions and statuses come from the package index, see refresh-index)')
+        self.add_argument_index(group)
+        group.add_argument('--cache', action='store_true',
+                           help='reuse the result of a previous parse of the same content '
+                                '(results are cached in REQUIRES_CACHE_DIR, default: ~/.cache/requires.io)')
+        group.add_argument('--cache-ttl', metavar='SECONDS', type=int, default=3600,
+                           help='how long cached results are valid (default: 3600)')
+        self.add_argument_discovery(group)
+        group.add_argument('paths', metavar='PATH', nargs='+',
+                           help='requirements files or folders containing requirement files to process (glob allowed)')
+
+    def parse_paths(self, args):
+        from requires_io.discovery import DiscoveryCache
+
+        # Folders are listed once all the arguments are known, as they depend on --discovery
+        files_type = FilesType(args.discovery, DiscoveryCache() if args.discovery_cache else None, self.tracer)
+        paths = []
+        with self.metrics.phase('discovery'):
+            for value in args.paths:
+                try:
+                    paths.extend(files_type(value))
+                except argparse.ArgumentTypeError as e:
+                    args.command_parser.error('argument PATH: %s' % e)
+        return paths
+
+    def parse(self, api, args):
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        paths = self.parse_paths(args)
+        # a file can be matched by several patterns
+        seen = set()
+        paths = [path for path in paths if not (path in seen or seen.add(path))]
+        failures = 0
+        write_header(args.format, sys.stdout)
+        if args.offline:
+            return self.parse_offline(paths, args)
+        # lines carry their path: unless ordered, write them as each response arrives, from the workers
+        streaming = args.format != TABLE and not args.ordered
+        output = _LineWriter(sys.stdout)
+
+        def stream(path):
+            self.print_requirements(path, api.get_requirements(path, args.file_type, stream=True),
+                                    args.format, False, stream=output)
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            if streaming:
+                futures = [executor.submit(stream, path) for path in paths]
+            else:
+                futures = [executor.submit(api.get_requirements, path, args.file_type) for path in paths]
+            names = dict(zip(futures, paths))
+            for future in futures if args.ordered else as_completed(futures):
+                try:
+                    requirements = future.result()
+                except Exception as e:
+                    failures += 1
+                    log.error('failed to parse %s: %s', names[future], e)
+                else:
+                    if not streaming:
+                        self.print_requirements(names[future], requirements, args.format, len(paths) > 1,
+                                                args.column_width)
+        if failures:
+            sys.exit(1)
+
+    def parse_offline(self, paths, args):
+        from requires_io.index import PackageIndex
+        from requires_io.parsers import parse_file
+
+        index = PackageIndex(args.index)
+        if not index.exists():
+            if args.index:
+                args.command_parser.error('argument --index: %s does not exist' % args.index)
+            index = None
+        requested = set(paths)
+        pending = list(reversed(paths))
+        seen = set(paths)
+        failures = 0
+        while pending:
+            path = pending.pop()
+            try:
+                parsed = parse_file(path, args.file_type if path in requested else None)
+            except (IOError, OSError) as e:
+                failures += 1
+                log.error('failed to parse %s: %s', path, e)
+                continue
+            # included files are parsed right after the file including them
+            for include in reversed(parsed.includes):
+                if include in seen:
+                    continue
+                seen.add(include)
+                if os.path.isfile(include):
+                    pending.append(include)
+                else:
+                    log.warning('%s includes %s which does not exist', path, include)
+            if index is not None:
+                index.annotate(parsed.requirements)
+            self.print_requirements(path, parsed.requirements, args.format, len(seen) > 1, args.column_width)
+        if failures:
+            sys.exit(1)
+
+    # =========================================================================
+    # INDEX
+    # -------------------------------------------------------------------------
+    def add_argument_index(self, group):
+        group.add_argument('--index', metavar='PATH',
+                           help='package index file (default: index.sqlite in REQUIRES_CACHE_DIR, '
+                                'default: ~/.cache/requires.io)')
+
+    def add_parser_refresh_index(self):
+        group = self.add_parser('refresh-index', 'rebuild the package index used by parse --offline',
+                                self.refresh_index)
+        group.add_argument('--dump', metavar='PATH',
+                           help='JSON file mapping package names to their releases, oldest first '
+                                '(default: download it from the API server)')
+        self.add_argument_index(group)
+
+    def refresh_index(self, api, args):
+        from requires_io.index import PackageIndex, load_dump
+
+        with self.metrics.phase('download'):
+            packages = load_dump(args.dump) if args.dump else api.get_packages()
+        index = PackageIndex(args.index)
+        with self.metrics.phase('index'):
+            count = index.refresh(packages)
+        log.info('%d packages indexed in %s', count, index.path)
+
+    def print_requirements(self, path, requirements, output_format, header, column_width=None, stream=None):
+        stream = sys.stdout if stream is None else stream
+        if output_format == JSONL:
+            write_jsonl(requirements, stream, path=path)
+        elif output_format != TABLE:
+            write_rows(requirements, output_format, stream, path)
+        else:
+            if header:
+                stream.write('%s\n' % path)
+            draw(requirements, stream=stream, widths=column_width and (column_width,) * 4)
+        stream.flush()
 
 
 def main(args=sys.argv, setup_log=True):
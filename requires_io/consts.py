@@ -1,6 +1,41 @@
 # -*- coding: utf-8 -*-
+import re
+
 REQUIREMENTS = 'requirements'
 SETUP = 'setup.py'
 TOX = 'tox'
 BUILDOUT = 'buildout'
-TYPES = (REQUIREMENTS, SETUP, TOX, BUILDOUT)
\ No newline at end of file
+TYPES = (REQUIREMENTS, SETUP, TOX, BUILDOUT)
+
+# Known requirement files, the first group is the path of the file relative to its project
+glob_type_re = re.compile(r'''
+   [/\\](
+   setup\.py
+   |tox\.ini
+   |(buildout|versions)\.cfg
+   |(req|pip|dep)[\w-]*\.(txt|pip)
+   |requirements[/\\][\w-]*\.(pip|txt)
+   )$
+''', re.X | re.IGNORECASE)
+
+# How requirement files are found in folders
+WALK = 'walk'
+GIT = 'git'
+DISCOVERY_MODES = (WALK, GIT)
+
+# How the packages of a site are listed
+NATIVE = 'native'
+PIP = 'pip'
+COLLECTORS = (NATIVE, PIP)
+
+# Content encodings of compressed request bodies
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+ENCODINGS = (GZIP, DEFLATE)
+
+_normalize_re = re.compile(r'[-_.]+')
+
+
+def normalize(name):
+    """Normalized name of a package (PEP 503), to compare names."""
+    return _normalize_re.sub('-', name).lower()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from requires_io.cache import default_cache_dir, write_atomic
+from requires_io.consts import glob_type_re
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+# Candidates for glob_type_re, to let git filter its index (case insensitive glob pathspecs)
+git_pathspecs = [':(glob,icase)**/' + pattern for pattern in (
+    'setup.py', 'tox.ini', 'buildout.cfg', 'versions.cfg',
+    'req*.txt', 'req*.pip', 'pip*.txt', 'pip*.pip', 'dep*.txt', 'dep*.pip',
+    'requirements/*.txt', 'requirements/*.pip',
+)] + [
+    # files directly in the listed folder, which can be a requirements folder itself
+    ':(glob,icase)*.txt', ':(glob,icase)*.pip',
+]
+
+
+def match(path):
+    """Return the path of ``path`` relative to its project if it is a known requirement file."""
+    found = glob_type_re.search(path)
+    if found:
+        return found.group(1)
+    return None
+
+
+def _ignored(name):
+    # CVS and hidden folders
+    return name == 'CVS' or name.startswith('.')
+
+
+def _scan(folder):
+    # Patterns span at most the parent folder and the file name: match on that tail only
+    tail = os.sep + os.path.basename(folder) + os.sep
+    paths = {}
+    folders = []
+    try:
+        entries = scandir(folder)
+    except OSError:
+        return paths, folders
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # like os.walk, do not follow symbolic links to folders
+            if not _ignored(entry.name) and not entry.is_symlink():
+                folders.append(entry.path)
+        else:
+            relative = match(tail + entry.name)
+            if relative:
+                paths[entry.path] = relative
+    return paths, folders
+
+
+def _walk(folder):
+    paths = {}
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = match(path)
+            if relative:
+                paths[path] = relative
+        dirs[:] = [d for d in dirs if not _ignored(d)]
+    return paths
+
+
+# Seconds during which a modification time is not trusted: another change
+# within the timestamp granularity would leave it as is and go unnoticed
+RACY_WINDOW = 2
+
+
+def mtime_ns(stat):
+    """Modification time of a ``stat`` result, in nanoseconds."""
+    return getattr(stat, 'st_mtime_ns', None) or int(stat.st_mtime * 1e9)
+
+
+def is_racy(mtime, now, window=RACY_WINDOW):
+    """Whether ``mtime`` (in nanoseconds) is less than ``window`` seconds before ``now``."""
+    return mtime >= (now - window) * 1e9
+
+
+class DiscoveryCache(object):
+    """On disk cache of the folders listed during discovery.
+
+    Each folder is stored with its modification time, its requirement files
+    and its sub-folders. A folder modification time changes whenever an entry
+    is added, removed or renamed in it, so folders whose time did not change
+    are not listed again: only their ``stat`` is needed. Folders modified less
+    than ``racy_window`` seconds before the scan are not cached (see
+    :data:`RACY_WINDOW`).
+    """
+
+    def __init__(self, path=None, racy_window=RACY_WINDOW):
+        if path is None:
+            path = os.path.join(default_cache_dir(), 'discovery.json')
+        self.path = path
+        self.racy_window = racy_window
+        self.folders = {}
+        self.visited = {}
+        self.started = time.time()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self.folders = json.loads(f.read().decode('utf-8')).get('folders', {})
+        except (IOError, OSError, ValueError):
+            self.folders = {}
+        self.visited = {}
+        self.started = time.time()
+
+    def save(self, root):
+        # forget the folders of this tree which do not exist anymore
+        prefix = os.path.join(root, '')
+        folders = dict((folder, entry) for folder, entry in self.folders.items()
+                       if folder != root and not folder.startswith(prefix))
+        folders.update(self.visited)
+        write_atomic(self.path, json.dumps({'folders': folders}).encode('utf-8'))
+
+    def scan(self, folder):
+        try:
+            mtime = mtime_ns(os.stat(folder))
+        except OSError:
+            return {}, []
+        entry = self.folders.get(folder)
+        if entry is not None and entry[0] == mtime:
+            with self._lock:
+                self.hits += 1
+            self.visited[folder] = entry
+            paths = dict((os.path.join(folder, name), relative) for name, relative in entry[1].items())
+            return paths, [os.path.join(folder, name) for name in entry[2]]
+        with self._lock:
+            self.misses += 1
+        paths, folders = _scan(folder)
+        if not is_racy(mtime, self.started, self.racy_window):
+            self.visited[folder] = [
+                mtime,
+                dict((os.path.basename(path), relative) for path, relative in paths.items()),
+                [os.path.basename(f) for f in folders],
+            ]
+        return paths, folders
+
+
+def _discover(folder, scan=_scan):
+    paths = {}
+    pending = [folder]
+    while pending:
+        found, folders = scan(pending.pop())
+        paths.update(found)
+        pending.extend(folders)
+    return paths
+
+
+def discover(folder, workers=DEFAULT_WORKERS, cache=None, hook=None):
+    """Find the requirement files below ``folder``.
+
+    Returns a ``{absolute path: relative path}`` mapping. Folders are listed
+    with ``os.scandir``, reusing the file types it returns instead of calling
+    ``stat``. With more than one worker, the top of the tree is listed
+    breadth first until there are enough independent sub-trees to keep the
+    workers busy, then each sub-tree is walked by a thread of the pool.
+    Unchanged folders are not listed again when a :class:`DiscoveryCache` is
+    given. ``hook``, when given, receives the function listing a folder and
+    returns the one to use instead (to time each listing for instance).
+    """
+    if scandir is None:
+        return _walk(folder)
+    from concurrent.futures import ThreadPoolExecutor
+
+    scan = _scan
+    if cache is not None:
+        cache.load()
+        scan = cache.scan
+    if hook is not None:
+        scan = hook(scan)
+    if workers <= 1:
+        paths = _discover(folder, scan)
+    else:
+        paths = {}
+        pending = [folder]
+        while pending and len(pending) < workers * 4:
+            current, pending = pending, []
+            for f in current:
+                found, folders = scan(f)
+                paths.update(found)
+                pending.extend(folders)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for found in executor.map(functools.partial(_discover, scan=scan), pending):
+                paths.update(found)
+    if cache is not None:
+        cache.save(folder)
+    return paths
+
+
+def discover_git(folder):
+    """Find the requirement files below ``folder`` tracked by git.
+
+    Paths come from the git index, so untracked and ignored trees are never
+    listed. Returns ``None`` when ``folder`` is not in a git work tree.
+    """
+    import subprocess
+
+    try:
+        process = subprocess.Popen(['git', 'ls-files', '-z', '--'] + git_pathspecs, cwd=folder,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        log.debug('git not available, walk %s', folder)
+        return None
+    output, error = process.communicate()
+    if process.returncode:
+        log.debug('git ls-files failed in %s, walk it: %s', folder, error.strip())
+        return None
+    encoding = sys.getfilesystemencoding()
+    paths = {}
+    for name in output.split(b'\0'):
+        if not name:
+            continue
+        parts = name.decode(encoding).split('/')
+        if any(_ignored(part) for part in parts[:-1]):
+            continue
+        path = os.path.join(folder, *parts)
+        # like _scan, the name of the listed folder is part of the tail
+        relative = match(os.sep + os.sep.join(([os.path.basename(folder)] + parts)[-2:]))
+        # the index can list files deleted from the work tree
+        if relative and os.path.isfile(path):
+            paths[path] = relative
+    return paths
@@ -1,31 +1,96 @@
 # -*- coding: utf-8 -*-
 import sys
 
+TABLE = 'table'
+JSONL = 'jsonl'
+CSV = 'csv'
+TSV = 'tsv'
+FORMATS = (TABLE, JSONL, CSV, TSV)
 
-def column_length(requirements, title, key):
-    l = lambda r: len(key(r))
-    if not requirements:
-        return len(title)
-    return max(len(title), l(max(requirements, key=l)))
-
-
-def draw(requirements, stream=sys.stdout):
-    t_name = 'Package'
-    t_specs = 'Requirement'
-    t_latest_version = 'Latest'
-    t_status = 'Status'
-    l_name = column_length(requirements, t_name, lambda r: r['package']['name'])
-    l_specs = column_length(requirements, t_specs, lambda r: r['specs'])
-    l_latest_version = column_length(requirements, t_latest_version, lambda r: r['latest']['version'])
-    l_status = column_length(requirements, t_status, lambda r: r['status'])
-    string_format = '%%-%ds  %%-%ds  %%-%ds  %%-%ds\n' % (l_name, l_specs, l_latest_version, l_status)
-    separator = string_format % (l_name * '=', l_specs * '=', l_latest_version * '=', l_status * '=')
+TITLES = ('Package', 'Requirement', 'Latest', 'Status')
+FIELDS = ('package', 'specs', 'latest', 'status')
+
+
+def row(requirement):
+    return (
+        requirement['package']['name'],
+        requirement['specs'],
+        requirement['latest']['version'],
+        requirement['status'],
+    )
+
+
+def _truncate(value, width):
+    if len(value) <= width:
+        return value
+    return value[:width - 3] + '...' if width > 3 else value[:width]
+
+
+def draw(requirements, stream=sys.stdout, widths=None):
+    """Write ``requirements`` as a text table.
+
+    Columns fit their content: ``requirements`` are read once, keeping only
+    the text of their rows until the table is written. When ``widths`` gives
+    the width of each column, rows are written as soon as they are read and
+    longer values are truncated.
+    """
+    if widths is None:
+        rows = [row(requirement) for requirement in requirements]
+        widths = [len(title) for title in TITLES]
+        if rows:
+            widths = [max(width, max(map(len, column))) for width, column in zip(widths, zip(*rows))]
+    else:
+        rows = (row(requirement) for requirement in requirements)
+    string_format = '  '.join('%%-%ds' % width for width in widths) + '\n'
+    size = sum(widths) + 2 * (len(widths) - 1) + 1
+    separator = string_format % tuple(width * '=' for width in widths)
     stream.write(separator)
-    stream.write(string_format % (t_name, t_specs, t_latest_version, t_status))
+    stream.write(string_format % tuple(_truncate(title, width) for title, width in zip(TITLES, widths)))
     stream.write(separator)
-    if requirements:
-        for r in requirements:
-            stream.write(string_format % (r['package']['name'], r['specs'], r['latest']['version'], r['status']))
-    else:
-        stream.write(string_format % ('-', '-', '-', '-'))
+    empty = True
+    for values in rows:
+        line = string_format % values
+        if len(line) != size:
+            # only longer values than their column make a longer line
+            line = string_format % tuple(_truncate(value, width) for value, width in zip(values, widths))
+        stream.write(line)
+        empty = False
+    if empty:
+        stream.write(string_format % (('-',) * len(widths)))
     stream.write(separator)
+
+
+def write_jsonl(requirements, stream=sys.stdout, **fields):
+    """Write a JSON object per requirement, with the extra ``fields``."""
+    import json
+
+    for requirement in requirements:
+        stream.write(json.dumps(dict(requirement, **fields), sort_keys=True) + '\n')
+
+
+def _csv_field(value):
+    if any(c in value for c in ',"\r\n'):
+        return '"%s"' % value.replace('"', '""')
+    return value
+
+
+def _tsv_field(value):
+    return value.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+
+def write_header(output_format, stream=sys.stdout, path=True):
+    """Write the header line of the CSV and TSV formats."""
+    if output_format in (CSV, TSV):
+        titles = (('path',) if path else ()) + FIELDS
+        stream.write(('\t' if output_format == TSV else ',').join(titles) + '\n')
+
+
+def write_rows(requirements, output_format, stream=sys.stdout, path=None):
+    """Write a CSV (RFC 4180) or TSV line per requirement, starting with ``path`` if given."""
+    if output_format == TSV:
+        separator, field = '\t', _tsv_field
+    else:
+        separator, field = ',', _csv_field
+    prefix = () if path is None else (path,)
+    for requirement in requirements:
+        stream.write(separator.join(field(value) for value in prefix + row(requirement)) + '\n')
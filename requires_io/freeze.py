@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import codecs
+import glob
+import logging
+import os
+import sys
+
+from requires_io.consts import NATIVE, normalize
+
+log = logging.getLogger(__name__)
+
+# Not reported by pip freeze either
+SKIP = frozenset(['pip', 'setuptools', 'wheel', 'distribute'])
+
+
+def check_output(*args, **kwargs):
+    # subprocess is only needed when running pip
+    import subprocess
+
+    if hasattr(subprocess, 'check_output'):
+        return subprocess.check_output(*args, **kwargs)
+    process = subprocess.Popen(stdout=subprocess.PIPE, *args, **kwargs)
+    output, unused_err = process.communicate()
+    code = process.poll()
+    if code:
+        cmd = kwargs.get('args')
+        if cmd is None:
+            cmd = args[0]
+        raise subprocess.CalledProcessError(code, cmd, output=output)
+    return output
+
+
+def pip_freeze():
+    output = check_output(['pip', 'freeze', '--local'])
+    encoding = getattr(sys.stdout, 'encoding', 'utf-8')
+    return codecs.decode(output, encoding, 'replace')
+
+
+def site_paths():
+    """Folders of ``sys.path`` holding the distributions of this environment.
+
+    Like ``pip freeze --local``, only the folders of the virtualenv are kept
+    when running in one.
+    """
+    base_prefix = getattr(sys, 'real_prefix', getattr(sys, 'base_prefix', sys.prefix))
+    prefix = os.path.join(os.path.abspath(sys.prefix), '')
+    paths = []
+    for path in sys.path:
+        if not path or not os.path.isdir(path):
+            continue
+        path = os.path.abspath(path)
+        if base_prefix != sys.prefix and not path.startswith(prefix):
+            continue
+        paths.append(path)
+    return paths
+
+
+def _site_packages(root):
+    paths = []
+    for pattern in ('lib/python*/site-packages', 'lib64/python*/site-packages', 'lib/site-packages',
+                    'Lib/site-packages', 'lib/pypy*/site-packages', 'site-packages'):
+        for path in sorted(glob.glob(os.path.join(root, *pattern.split('/')))):
+            path = os.path.realpath(path)
+            if os.path.isdir(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def environment(path):
+    """Return the ``(root, site paths)`` of the environment designated by ``path``.
+
+    ``path`` can be the interpreter of a virtualenv, the virtualenv itself or
+    one of its ``site-packages`` folders.
+    """
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        # bin/python (Scripts\python.exe on Windows)
+        root = os.path.dirname(os.path.dirname(path))
+        return root, _site_packages(root)
+    if os.path.basename(path) in ('site-packages', 'dist-packages'):
+        parent = os.path.dirname(path)
+        # lib/pythonX.Y/site-packages or Lib/site-packages
+        if os.path.basename(parent).lower().startswith(('python', 'pypy')):
+            parent = os.path.dirname(parent)
+        return os.path.dirname(parent), [path]
+    return path, _site_packages(path)
+
+
+def find_environments(root, depth=3):
+    """Find the virtualenvs at most ``depth`` folders below ``root``."""
+    environments = []
+    pending = [(os.path.abspath(root), 0)]
+    while pending:
+        folder, level = pending.pop()
+        if os.path.isfile(os.path.join(folder, 'pyvenv.cfg')) or \
+                os.path.isfile(os.path.join(folder, 'bin', 'activate')) or \
+                os.path.isfile(os.path.join(folder, 'Scripts', 'activate')):
+            environments.append(folder)
+            continue
+        if level >= depth:
+            continue
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                pending.append((path, level + 1))
+    return sorted(environments)
+
+
+def _read_metadata(path):
+    name = version = None
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.decode('utf-8', 'replace').rstrip()
+                if not line:
+                    # end of the headers
+                    break
+                if line.startswith('Name:'):
+                    name = line[5:].strip()
+                elif line.startswith('Version:'):
+                    version = line[8:].strip()
+                if name and version:
+                    break
+    except (IOError, OSError):
+        return None
+    if name and version:
+        return name, version
+    return None
+
+
+def _metadata_path(folder, name):
+    path = os.path.join(folder, name)
+    if name.endswith('.dist-info'):
+        return os.path.join(path, 'METADATA')
+    if name.endswith('.egg-info'):
+        # either a folder or a single PKG-INFO file
+        if os.path.isdir(path):
+            return os.path.join(path, 'PKG-INFO')
+        return path
+    if name.endswith('.egg') and os.path.isdir(path):
+        return os.path.join(path, 'EGG-INFO', 'PKG-INFO')
+    return None
+
+
+def distributions(paths=None):
+    """Yield the ``(name, version)`` of the distributions installed in ``paths``.
+
+    Metadata is read from ``*.dist-info``, ``*.egg-info`` and ``*.egg`` entries;
+    when a project is installed several times, the first one found wins as
+    it is the one imported.
+    """
+    seen = set()
+    for folder in site_paths() if paths is None else paths:
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError:
+            continue
+        for name in names:
+            path = _metadata_path(folder, name)
+            if path is None:
+                continue
+            distribution = _read_metadata(path)
+            if distribution is None or normalize(distribution[0]) in seen:
+                continue
+            seen.add(normalize(distribution[0]))
+            yield distribution
+
+
+class FreezePayload(object):
+    """``pip freeze`` like body listing the distributions installed in ``paths``.
+
+    The distributions are enumerated in process when the payload is created
+    and their ``name==version`` lines are produced as encoded chunks when it
+    is iterated.
+    """
+
+    def __init__(self, paths=None, skip=SKIP, chunk_size=16 * 1024):
+        self.packages = sorted(
+            (d for d in distributions(paths) if normalize(d[0]) not in skip),
+            key=lambda d: d[0].lower(),
+        )
+        self.chunk_size = chunk_size
+
+    def __length_hint__(self):
+        return sum(len(name) + len(version) + 3 for name, version in self.packages)
+
+    def __iter__(self):
+        lines = []
+        size = 0
+        for name, version in self.packages:
+            line = ('%s==%s\n' % (name, version)).encode('utf-8')
+            lines.append(line)
+            size += len(line)
+            if size >= self.chunk_size:
+                yield b''.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield b''.join(lines)
+
+
+def collect(collector=NATIVE, paths=None):
+    """Return the body reporting an environment, with the given collector.
+
+    ``paths`` designates another environment and is only supported by the
+    native collector; for the current environment, the native collector
+    falls back to pip when it does not find any distribution.
+    """
+    if paths is not None:
+        if collector != NATIVE:
+            raise ValueError('only the %s collector supports other environments' % NATIVE)
+        return FreezePayload(paths)
+    if collector == NATIVE:
+        payload = FreezePayload()
+        if payload.packages:
+            return payload
+        log.info('no distribution found, fall back to pip freeze')
+    return pip_freeze()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Local index of the known releases of packages, for offline statuses.
+
+The index is a SQLite file mapping each normalized package name (PEP 503)
+to its latest version and its releases. It is rebuilt from a dump, a JSON
+object mapping package names to their releases (or to their latest
+version), and replaced atomically so that readers never see a partial
+index.
+"""
+import json
+import logging
+import os
+
+from requires_io.cache import _replace, default_cache_dir
+from requires_io.consts import normalize
+from requires_io.versions import latest, statuses
+
+log = logging.getLogger(__name__)
+
+# names looked up per query, below the SQLite limit of host parameters
+BATCH_SIZE = 500
+
+_SCHEMA = '''
+CREATE TABLE packages (
+    name TEXT PRIMARY KEY,
+    latest TEXT NOT NULL,
+    releases TEXT NOT NULL
+) WITHOUT ROWID
+'''
+
+
+def default_index_path():
+    return os.path.join(default_cache_dir(), 'index.sqlite')
+
+
+def load_dump(path):
+    """Releases of each package of a dump file, as a dict."""
+    with open(path, 'rb') as f:
+        packages = json.loads(f.read().decode('utf-8'))
+    if not isinstance(packages, dict):
+        raise ValueError('%s is not a JSON object mapping package names to their releases' % path)
+    return packages
+
+
+class PackageIndex(object):
+    def __init__(self, path=None):
+        self.path = default_index_path() if path is None else path
+        self._connection = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def _connect(self):
+        if self._connection is None:
+            import sqlite3
+
+            self._connection = sqlite3.connect(self.path)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def refresh(self, packages):
+        """Replace the index by ``packages``, mapping names to their releases or to a version.
+
+        Returns the number of packages indexed.
+        """
+        import sqlite3
+        import tempfile
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+        os.close(fd)
+        rows = {}
+        for name, releases in packages.items():
+            if not isinstance(releases, list):
+                releases = [releases]
+            version = latest(releases)
+            if version:
+                rows[normalize(name)] = (version, '\n'.join(release for release in releases if release))
+        try:
+            connection = sqlite3.connect(tmp)
+            try:
+                with connection:
+                    connection.execute(_SCHEMA)
+                    connection.executemany('INSERT INTO packages VALUES (?, ?, ?)',
+                                           ((name, latest, releases) for name, (latest, releases) in rows.items()))
+            finally:
+                connection.close()
+            self.close()
+            _replace(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        return len(rows)
+
+    def latest(self, names):
+        """Latest version of each known package of ``names``, keyed by normalized name."""
+        return self._latest(set(normalize(name) for name in names))
+
+    def _latest(self, names):
+        names = sorted(names)
+        connection = self._connect()
+        found = {}
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            found.update(connection.execute('SELECT name, latest FROM packages WHERE name IN (%s)'
+                                            % ','.join('?' * len(batch)), batch))
+        return found
+
+    def releases(self, name):
+        row = self._connect().execute('SELECT releases FROM packages WHERE name = ?', (normalize(name),)).fetchone()
+        return row[0].split('\n') if row else []
+
+    def annotate(self, requirements):
+        """Set the latest version and the status of ``requirements`` from the index, in place."""
+        names = [normalize(requirement['package']['name']) for requirement in requirements]
+        found = self._latest(set(names))
+        versions = [found.get(name, '') for name in names]
+        pins = zip([requirement['specs'] for requirement in requirements], versions)
+        for requirement, version, status in zip(requirements, versions, statuses(pins)):
+            requirement['latest'] = {'version': version}
+            requirement['status'] = status
+        return requirements
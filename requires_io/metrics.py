@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import threading
+import time
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+COUNTERS = ('requests', 'retries', 'bytes_read', 'bytes_sent', 'bytes_received')
+
+JSON = 'json'
+PROMETHEUS = 'prometheus'
+FORMATS = (JSON, PROMETHEUS)
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class _MeasuredPayload(object):
+    # Re-iterable body counting the bytes sent and the time spent producing them
+    def __init__(self, data, metrics):
+        self.data = data
+        self.metrics = metrics
+
+    def __iter__(self):
+        iterator = iter(self.data)
+        elapsed = 0.0
+        size = 0
+        try:
+            while True:
+                start = time.time()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.time() - start
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.metrics.add_phase('encoding', elapsed)
+            self.metrics.add('bytes_sent', size)
+
+
+class Metrics(object):
+    """Durations of the phases of a run, transfer counters and request latencies.
+
+    All the methods are thread safe. ``phases`` maps each phase name to its
+    number of occurrences and total duration in seconds; streamed bodies are
+    produced while they are sent, so ``encoding`` time also counts in the
+    request latencies.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_phase(self, name, seconds, count=1):
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0])
+            phase[0] += count
+            phase[1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - start)
+
+    def observe(self, seconds):
+        with self._lock:
+            self.latency.observe(seconds)
+
+    def stream(self, data):
+        """Body to send instead of ``data`` so that its size (and production time) is recorded."""
+        if data is None or isinstance(data, dict):
+            return data
+        if hasattr(data, '__len__'):
+            self.add('bytes_sent', len(data))
+            return data
+        return _MeasuredPayload(data, self)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'phases': dict((name, {'count': count, 'seconds': seconds})
+                               for name, (count, seconds) in self.phases.items()),
+                'counters': dict(self.counters),
+                'request_seconds': {
+                    'buckets': dict(('+Inf' if bound == float('inf') else str(bound), count)
+                                    for bound, count in self.latency.cumulative()),
+                    'count': self.latency.count,
+                    'sum': self.latency.sum,
+                },
+            }
+
+    def to_json(self):
+        import json
+
+        return json.dumps(self.as_dict(), sort_keys=True) + '\n'
+
+    def to_prometheus(self, prefix='requires_io'):
+        """Metrics in the Prometheus text exposition format (for the node exporter textfile collector)."""
+        data = self.as_dict()
+        with self._lock:
+            buckets = list(self.latency.cumulative())
+        lines = [
+            '# HELP %s_phase_seconds_total Time spent in each phase of the run.' % prefix,
+            '# TYPE %s_phase_seconds_total counter' % prefix,
+        ]
+        for name, phase in sorted(data['phases'].items()):
+            lines.append('%s_phase_seconds_total{phase="%s"} %r' % (prefix, name, phase['seconds']))
+        lines.extend([
+            '# HELP %s_phase_total Occurrences of each phase of the run.' % prefix,
+            '# TYPE %s_phase_total counter' % prefix,
+        ])
+        for name, phase in sorted(data['phases'].items()):
+            lines.append('%s_phase_total{phase="%s"} %d' % (prefix, name, phase['count']))
+        for name, value in sorted(data['counters'].items()):
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            lines.append('%s_%s_total %d' % (prefix, name, value))
+        histogram = '%s_request_duration_seconds' % prefix
+        lines.extend([
+            '# HELP %s Latency of the API requests.' % histogram,
+            '# TYPE %s histogram' % histogram,
+        ])
+        for bound, count in buckets:
+            lines.append('%s_bucket{le="%s"} %d' % (histogram, '+Inf' if bound == float('inf') else bound, count))
+        lines.append('%s_sum %r' % (histogram, data['request_seconds']['sum']))
+        lines.append('%s_count %d' % (histogram, data['request_seconds']['count']))
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(object):
+    """Metrics discarding everything, used when nothing is recorded."""
+
+    def add(self, counter, value=1):
+        pass
+
+    def add_phase(self, name, seconds, count=1):
+        pass
+
+    def phase(self, name):
+        return _null_phase
+
+    def observe(self, seconds):
+        pass
+
+    def stream(self, data):
+        return data
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
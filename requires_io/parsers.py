@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Local parsers of the requirement files known by requires.io.
+
+Each parser returns a :class:`Parsed` holding the requirements of a file
+(name, specifiers, extras and environment marker of each package) and the
+other files it includes (``-r``/``-c`` in requirement files, ``-r`` in tox
+deps, ``extends`` in buildout files), without any network round trip.
+"""
+import ast
+import codecs
+import logging
+import os
+import re
+
+try:
+    from configparser import RawConfigParser, Error as ConfigError
+except ImportError:  # Python 2
+    from ConfigParser import RawConfigParser, Error as ConfigError
+
+from requires_io.consts import BUILDOUT, REQUIREMENTS, SETUP, TOX, TYPES
+
+log = logging.getLogger(__name__)
+
+_requirement_re = re.compile(r'''
+    ^(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)
+    \s*(?:\[(?P<extras>[^\]]*)\])?
+    \s*(?:@\s*(?P<url>\S+)|\(?(?P<specs>[^;()]*)\)?)
+    \s*(?:;\s*(?P<marker>.*))?$
+''', re.X)
+_egg_re = re.compile(r'[#&]egg=(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)')
+# pip options allowed after a requirement on the same line
+_line_option_re = re.compile(r'\s+--?[a-z][\w-]*(?:[=\s]\S+)?.*$')
+_comment_re = re.compile(r'(^|\s+)#.*$')
+_include_re = re.compile(r'^(?:-r|--requirement|-c|--constraint)(?:\s*=\s*|\s+|(?=\S))(?P<path>\S+)')
+_editable_re = re.compile(r'^(?:-e|--editable)(?:\s*=\s*|\s+)(?P<url>\S+)')
+_factors_re = re.compile(r'^[\w.,!-]+:\s+')
+_space_re = re.compile(r'\s+')
+
+SETUP_KEYWORDS = ('setup_requires', 'install_requires', 'tests_require', 'extras_require')
+
+
+class Parsed(object):
+    def __init__(self, path, file_type, requirements=None, includes=None):
+        self.path = path
+        self.file_type = file_type
+        self.requirements = requirements or []
+        self.includes = includes or []
+
+
+def guess_type(path):
+    name = os.path.basename(path).lower()
+    if name == 'setup.py':
+        return SETUP
+    if name == 'tox.ini':
+        return TOX
+    if name.endswith('.cfg'):
+        return BUILDOUT
+    return REQUIREMENTS
+
+
+def requirement(text, **fields):
+    """Requirement record of a PEP 508 string, None if it does not name a package."""
+    match = _requirement_re.match(text.strip())
+    if match is None:
+        return None
+    extras = match.group('extras')
+    record = {
+        'package': {'name': match.group('name')},
+        'specs': _space_re.sub('', match.group('specs') or ''),
+        'extras': sorted(e.strip() for e in extras.split(',') if e.strip()) if extras else [],
+        'latest': {'version': ''},
+        'status': '',
+    }
+    if match.group('url'):
+        record['url'] = match.group('url')
+    if match.group('marker'):
+        record['marker'] = match.group('marker').strip()
+    record.update(fields)
+    return record
+
+
+def _logical_lines(text):
+    # join the lines continued with a backslash, keeping the number of their first line
+    number, parts = None, []
+    for index, line in enumerate(text.splitlines(), 1):
+        if number is None:
+            number = index
+        if line.endswith('\\'):
+            parts.append(line[:-1])
+            continue
+        parts.append(line)
+        yield number, ''.join(parts)
+        number, parts = None, []
+    if parts:
+        yield number, ''.join(parts)
+
+
+def parse_requirements(text, path=None, **fields):
+    folder = os.path.dirname(path) if path else ''
+    parsed = Parsed(path, REQUIREMENTS)
+    for number, line in _logical_lines(text):
+        line = _comment_re.sub('', line).strip()
+        if not line:
+            continue
+        if line.startswith('-'):
+            include = _include_re.match(line)
+            editable = _editable_re.match(line)
+            if include:
+                parsed.includes.append(os.path.normpath(os.path.join(folder, include.group('path'))))
+            elif editable:
+                egg = _egg_re.search(editable.group('url'))
+                if egg:
+                    parsed.requirements.append(requirement(egg.group('name'), line=number, editable=True, **fields))
+            continue
+        egg = _egg_re.search(line) if '://' in line else None
+        if egg:
+            record = requirement(egg.group('name'), line=number, url=line.split('#')[0], **fields)
+        else:
+            record = requirement(_line_option_re.sub('', line), line=number, **fields)
+        if record is not None:
+            parsed.requirements.append(record)
+    return parsed
+
+
+def _values(node, names):
+    # literal value of a setup() argument, following module level names, + and .append()/.extend()
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _values(node.left, names), _values(node.right, names)
+        if isinstance(left, list) and isinstance(right, list):
+            return left + right
+        return None
+    if isinstance(node, ast.Dict):
+        values = {}
+        for key, value in zip(node.keys, node.values):
+            # None keys are ** unpackings
+            if key is not None:
+                try:
+                    values[ast.literal_eval(key)] = _values(value, names)
+                except (TypeError, ValueError):
+                    pass
+        return values
+    try:
+        value = ast.literal_eval(node)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, tuple):
+        value = list(value)
+    return value
+
+
+def _module_names(tree):
+    names = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            value = _values(node.value, names)
+            if value is not None:
+                names[node.targets[0].id] = value
+    # names are completed by .append() and .extend() calls anywhere in the module
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and
+                isinstance(node.func.value, ast.Name) and isinstance(names.get(node.func.value.id), list) and
+                node.func.attr in ('append', 'extend') and len(node.args) == 1):
+            value = _values(node.args[0], names)
+            if node.func.attr == 'append' and value is not None:
+                names[node.func.value.id].append(value)
+            elif isinstance(value, list):
+                names[node.func.value.id].extend(value)
+    return names
+
+
+def _lines(value):
+    if isinstance(value, list):
+        for item in value:
+            for line in _lines(item):
+                yield line
+    elif value is not None and hasattr(value, 'splitlines'):
+        for line in value.splitlines():
+            yield line
+
+
+def parse_setup(text, path=None):
+    parsed = Parsed(path, SETUP)
+    try:
+        tree = ast.parse(text)
+    except SyntaxError as e:
+        log.warning('failed to parse %s: %s', path or 'setup.py', e)
+        return parsed
+    names = _module_names(tree)
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        if getattr(func, 'id', None) != 'setup' and getattr(func, 'attr', None) != 'setup':
+            continue
+        for keyword in node.keywords:
+            if keyword.arg not in SETUP_KEYWORDS:
+                continue
+            value = _values(keyword.value, names)
+            if keyword.arg == 'extras_require':
+                groups = sorted((value or {}).items()) if isinstance(value, dict) else []
+                sections = [('extras_require:%s' % extra, lines) for extra, lines in groups]
+            else:
+                sections = [(keyword.arg, value)]
+            for section, lines in sections:
+                parsed.requirements.extend(r for r in (requirement(_comment_re.sub('', line), section=section)
+                                                       for line in _lines(lines)) if r is not None)
+    return parsed
+
+
+def _config(text):
+    try:
+        parser = RawConfigParser(strict=False)
+    except TypeError:  # Python 2
+        parser = RawConfigParser()
+    parser.optionxform = str
+    try:
+        parser.read_string(text)
+    except AttributeError:  # Python 2
+        import StringIO
+
+        parser.readfp(StringIO.StringIO(text))
+    return parser
+
+
+def parse_tox(text, path=None):
+    parsed = Parsed(path, TOX)
+    try:
+        config = _config(text)
+    except ConfigError as e:
+        log.warning('failed to parse %s: %s', path or 'tox.ini', e)
+        return parsed
+    for section in config.sections():
+        if section != 'testenv' and not section.startswith('testenv:') or not config.has_option(section, 'deps'):
+            continue
+        lines = []
+        for line in config.get(section, 'deps').splitlines():
+            # includes are relative to the tox.ini folder already; substitutions
+            # of other sections deps are parsed with their section
+            line = _factors_re.sub('', line.replace('{toxinidir}', '.')).strip()
+            if line and '{' not in line:
+                lines.append(line)
+        deps = parse_requirements('\n'.join(lines), path, section=section)
+        parsed.requirements.extend(deps.requirements)
+        parsed.includes.extend(deps.includes)
+    return parsed
+
+
+def parse_buildout(text, path=None):
+    folder = os.path.dirname(path) if path else ''
+    parsed = Parsed(path, BUILDOUT)
+    try:
+        config = _config(text)
+    except ConfigError as e:
+        log.warning('failed to parse %s: %s', path or 'buildout.cfg', e)
+        return parsed
+    versions = ['versions']
+    if config.has_option('buildout', 'versions'):
+        versions.append(config.get('buildout', 'versions').strip())
+    if config.has_option('buildout', 'extends'):
+        extends = config.get('buildout', 'extends').split()
+        parsed.includes.extend(os.path.normpath(os.path.join(folder, extend)) for extend in extends
+                               if '://' not in extend)
+    for section in config.sections():
+        for option, value in config.items(section):
+            option = option.rstrip(' +-')
+            if section in versions:
+                record = requirement('%s==%s' % (option, value.strip()), section=section)
+            elif option == 'eggs':
+                parsed.requirements.extend(r for r in (requirement(line, section=section)
+                                                       for line in value.splitlines()) if r is not None)
+                continue
+            else:
+                continue
+            if record is not None:
+                parsed.requirements.append(record)
+    return parsed
+
+
+PARSERS = {
+    REQUIREMENTS: parse_requirements,
+    SETUP: parse_setup,
+    TOX: parse_tox,
+    BUILDOUT: parse_buildout,
+}
+
+
+def parse(text, file_type, path=None):
+    """Parse the content of a requirement file of the given type (one of ``consts.TYPES``)."""
+    if file_type not in TYPES:
+        raise ValueError('invalid file type: %s' % file_type)
+    return PARSERS[file_type](text, path)
+
+
+def parse_file(path, file_type=None):
+    """Parse a requirement file, guessing its type from its name if not given."""
+    with codecs.open(path, 'r', 'utf-8', 'replace') as fd:
+        text = fd.read()
+    return parse(text, file_type or guess_type(path), path)
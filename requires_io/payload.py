@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import base64
+import codecs
+import json
+import logging
+import os
+import re
+import zlib
+
+from requires_io.consts import DEFLATE, GZIP
+
+log = logging.getLogger(__name__)
+
+# Files are read and encoded by blocks of this size, it has to be a multiple of 3 so that
+# every block but the last can be base64 encoded without padding.
+CHUNK_SIZE = 48 * 1024
+
+_space_re = re.compile(r'\s*')
+_separator_re = re.compile(r'[\s,]*')
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_THRESHOLD = 1024
+
+# zlib window bits producing each content encoding
+_WBITS = {
+    GZIP: 16 + zlib.MAX_WBITS,
+    DEFLATE: zlib.MAX_WBITS,
+}
+
+
+class ReferencePayload(object):
+    """JSON body of a branch or tag update, produced incrementally.
+
+    Iterating yields the ``[{"path": ..., "content": ...}, ...]`` document as
+    byte chunks of about ``chunk_size``: files are read and base64 encoded
+    block by block so memory use does not depend on the size of the files.
+    The payload can be iterated several times (each pass reopens the files).
+    ``span(name, cat, **args)``, when given, is the context manager timing
+    the reading and encoding of each block of the files.
+    """
+
+    def __init__(self, paths, chunk_size=CHUNK_SIZE, span=None):
+        self.paths = paths
+        self.span = span
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self.bytes_read = 0
+
+    def __length_hint__(self):
+        # Size of the encoded files, without the JSON envelope; not a __len__ so that the
+        # payload is still sent with a chunked transfer encoding
+        return sum(4 * ((os.path.getsize(path) + 2) // 3) for path in self.paths)
+
+    def __iter__(self):
+        buffer = []
+        size = 0
+        for piece in self._pieces():
+            buffer.append(piece)
+            size += len(piece)
+            if size >= self.chunk_size:
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield b''.join(buffer)
+
+    def _pieces(self):
+        self.bytes_read = 0
+        yield b'['
+        for index, (path, relative) in enumerate(sorted(self.paths.items())):
+            log.info('add %s to payload', relative)
+            if index:
+                yield b', '
+            yield b'{"path": ' + json.dumps(relative).encode('utf-8') + b', "content": "'
+            blocks = self._encode(path)
+            if self.span is not None:
+                blocks = self._traced(blocks, 'encode %s' % relative, path)
+            for block in blocks:
+                yield block
+            yield b'"}'
+        yield b']'
+
+    def _traced(self, blocks, name, path):
+        # one span per block: the upload of a block happens between two spans, not within one
+        while True:
+            with self.span(name, cat='payload', path=path):
+                block = next(blocks, None)
+            if block is None:
+                return
+            yield block
+
+    def _encode(self, path):
+        remainder = b''
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(self.chunk_size)
+                if not block:
+                    break
+                self.bytes_read += len(block)
+                if remainder:
+                    block = remainder + block
+                cut = len(block) - len(block) % 3
+                remainder = block[cut:]
+                if cut:
+                    yield base64.b64encode(block[:cut])
+        if remainder:
+            yield base64.b64encode(remainder)
+
+
+class CompressedPayload(object):
+    """Body ``data`` compressed with ``encoding`` (``gzip`` or ``deflate``).
+
+    ``data`` is either bytes, text or an iterable of byte chunks; chunks are
+    compressed as they are produced so the compressed body is streamed too.
+    The payload can be iterated several times if ``data`` can.
+    """
+
+    def __init__(self, data, encoding=GZIP, level=6):
+        if encoding not in _WBITS:
+            raise ValueError('invalid content encoding: %s' % encoding)
+        if not isinstance(data, bytes) and hasattr(data, 'encode'):
+            data = data.encode('utf-8')
+        self.data = data
+        self.encoding = encoding
+        self.level = level
+
+    def __iter__(self):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[self.encoding])
+        chunks = [self.data] if isinstance(self.data, bytes) else self.data
+        for chunk in chunks:
+            block = compressor.compress(chunk)
+            if block:
+                yield block
+        yield compressor.flush()
+
+
+def worth_compressing(data, threshold=COMPRESS_THRESHOLD):
+    """Whether ``data`` is expected to be at least ``threshold`` bytes long.
+
+    Iterables that cannot tell their size (no ``__len__`` or
+    ``__length_hint__``) are assumed to be large.
+    """
+    if hasattr(data, '__len__'):
+        return len(data) >= threshold
+    hint = getattr(data, '__length_hint__', None)
+    return hint is None or hint() >= threshold
+
+
+def iter_json_array(chunks, encoding='utf-8'):
+    """Yield the items of the JSON array sent as ``chunks`` of bytes, as soon as each one is complete."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(encoding)()
+    buffer = ''
+    position = 0
+    started = False
+    done = False
+    chunks = iter(chunks)
+    while not done:
+        chunk = next(chunks, None)
+        done = chunk is None
+        buffer += text.decode(b'', final=True) if done else text.decode(chunk)
+        if not started:
+            position = _space_re.match(buffer).end()
+            if position == len(buffer):
+                continue
+            if buffer[position] != '[':
+                raise ValueError('expected a JSON array')
+            started = True
+            position += 1
+        while True:
+            position = _separator_re.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if done:
+                    raise
+                break
+            # a number or a literal at the end of the buffer may go on in the next chunk
+            if end == len(buffer) and not done:
+                break
+            position = end
+            yield item
+        buffer = buffer[position:]
+        position = 0
+    raise ValueError('unterminated JSON array')
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import email.utils
+import logging
+import random
+import threading
+import time
+
+from requests.exceptions import ConnectionError, Timeout
+from requests.status_codes import codes
+
+log = logging.getLogger(__name__)
+
+# Methods that can be sent again without changing the outcome
+IDEMPOTENT = ('PUT', 'DELETE')
+
+# Statuses worth a retry, the server being busy or temporarily unavailable
+RETRY_STATUSES = (
+    codes.TOO_MANY_REQUESTS,
+    codes.INTERNAL_SERVER_ERROR,
+    codes.BAD_GATEWAY,
+    codes.SERVICE_UNAVAILABLE,
+    codes.GATEWAY_TIMEOUT,
+)
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait according to a ``Retry-After`` header, None if invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - (time.time() if now is None else now))
+
+
+class RetryPolicy(object):
+    """When and how long to wait before sending a request again.
+
+    Waits grow exponentially from ``backoff`` up to ``max_backoff`` with a
+    full jitter, unless the server tells how long to wait with ``Retry-After``:
+    that wait is honoured, and requests are not retried at all when it is
+    longer than ``max_backoff``.
+    """
+
+    def __init__(self, retries=5, backoff=0.5, max_backoff=60.0, methods=IDEMPOTENT, statuses=RETRY_STATUSES):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = methods
+        self.statuses = statuses
+
+    def can_retry(self, method, attempt):
+        return method.upper() in self.methods and attempt < self.retries
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt, None to give up."""
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_backoff else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class AIMDLimiter(object):
+    """Limit of concurrent requests, adjusted to what the server accepts.
+
+    Each success raises the limit by ``increase / limit`` (about ``increase``
+    per round of requests) up to ``maximum``, each overload multiplies it by
+    ``decrease`` down to ``minimum``.
+    """
+
+    def __init__(self, maximum=10, minimum=1, initial=None, increase=1.0, decrease=0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum if initial is None else initial)
+        self.increase = increase
+        self.decrease = decrease
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= max(self.minimum, int(self.limit)):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, overloaded=False):
+        with self._condition:
+            self.active -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+
+class Scheduler(object):
+    """Send requests within the limits of ``limiter``, retrying them according to ``policy``."""
+
+    def __init__(self, policy=None, limiter=None, sleep=time.sleep):
+        self.policy = RetryPolicy() if policy is None else policy
+        self.limiter = AIMDLimiter() if limiter is None else limiter
+        self.sleep = sleep
+
+    def call(self, method, url, send):
+        """Return the response of ``send()``, the last one if all the attempts failed."""
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            overloaded = True
+            try:
+                response = send()
+                overloaded = response.status_code in self.policy.statuses
+            except (ConnectionError, Timeout) as e:
+                if not self.policy.can_retry(method, attempt):
+                    raise
+                response = None
+                reason = str(e)
+            finally:
+                self.limiter.release(overloaded)
+            if not overloaded or not self.policy.can_retry(method, attempt):
+                return response
+            retry_after = None
+            if response is not None:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                reason = '%d %s' % (response.status_code, response.reason)
+            delay = self.policy.delay(attempt, retry_after)
+            if delay is None:
+                log.warning('%s %s failed (%s), not retried before %.1fs', method, url, reason, retry_after)
+                return response
+            if response is not None:
+                response.close()
+            attempt += 1
+            log.warning('%s %s failed (%s), retry %d/%d in %.1fs', method, url, reason, attempt, self.policy.retries,
+                        delay)
+            self.sleep(delay)
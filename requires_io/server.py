@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""In-process stand-in for the requires.io API, for tests and benchmarks.
+
+Serves the repository, branch, tag, site and requirements endpoints, and a
+dump of the known packages, from memory, with optional latency and error injection::
+
+    with FakeServer(token='secret', latency=0.01, error_rate=0.1) as server:
+        api = RequiresAPI('secret', base_url=server.url)
+        api.update_repository('foo', True)
+
+Run ``python -m requires_io.server`` to serve it on a fixed port.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+from requires_io.consts import ENCODINGS
+from requires_io.payload import _WBITS
+from requires_io.versions import latest, status
+
+PREFIX = '/api/v2/'
+
+_repository_re = re.compile(r'^repos/(?P<repository>[^/]+)/?$')
+_reference_re = re.compile(r'^repos/(?P<repository>[^/]+)/(?P<kind>branches|tags|sites)/(?P<name>[^/]+)/?$')
+_requirements_re = re.compile(r'^requirements/?$')
+_packages_re = re.compile(r'^packages/?$')
+_requirement_re = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?P<specs>[^;#]*)')
+
+Request = namedtuple('Request', 'client method path headers body')
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status, message=''):
+        super(HTTPFailure, self).__init__(message)
+        self.status = status
+
+
+def _multipart(content_type, body):
+    """Fields of a ``multipart/form-data`` body, as a dict of bytes."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or '')
+    if not match:
+        raise HTTPFailure(400, 'missing multipart boundary')
+    fields = {}
+    for part in body.split(b'--' + match.group(1).encode('ascii'))[1:-1]:
+        headers, _, value = part.partition(b'\r\n\r\n')
+        name = re.search(br'name="([^"]*)"', headers)
+        if name:
+            fields[name.group(1).decode('utf-8')] = value[:-2] if value.endswith(b'\r\n') else value
+    return fields
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately: without this, delayed ACKs stall kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _decode_body(self, body):
+        encoding = self.headers.get('Content-Encoding')
+        if encoding:
+            if encoding not in self.server.encodings:
+                raise HTTPFailure(415, 'unsupported content encoding %s' % encoding)
+            body = zlib.decompress(body, _WBITS[encoding])
+        return body
+
+    def _send(self, status, payload=None, headers=None):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        try:
+            # read the body first so that the connection can be kept alive whatever the reply
+            body = self._read_body()
+            server.record(Request(self.client_address, self.command, self.path, self.headers, body))
+            body = self._decode_body(body)
+            if server.latency:
+                time.sleep(server.latency)
+            failure = server.failure()
+            if failure:
+                return self._send(failure, {'detail': 'injected failure'}, server.failure_headers())
+            if server.token is not None and self.headers.get('Authorization') != 'Token %s' % server.token:
+                raise HTTPFailure(401, 'invalid token')
+            if not self.path.startswith(PREFIX):
+                raise HTTPFailure(404, 'not found')
+            path = unquote(self.path[len(PREFIX):].split('?')[0])
+            for regex, handler in ((_repository_re, server.repository),
+                                   (_reference_re, server.reference),
+                                   (_requirements_re, server.requirements),
+                                   (_packages_re, server.dump_packages)):
+                match = regex.match(path)
+                if match:
+                    status, payload = handler(self.command, body, self.headers, **match.groupdict())
+                    return self._send(status, payload)
+            raise HTTPFailure(404, 'not found')
+        except HTTPFailure as e:
+            self._send(e.status, {'detail': str(e)})
+
+    do_GET = do_PUT = do_DELETE = do_POST = _handle
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server holding repositories in memory.
+
+    Only requests authenticated with ``token`` are accepted (any token when
+    ``None``). Each request waits ``latency`` seconds and fails with
+    ``error_status`` with a probability of ``error_rate``; statuses queued in
+    ``failures`` are returned first. ``packages`` maps package names to their
+    latest version, or to their releases, for the requirements and packages
+    endpoints. Requests received are recorded in ``history``, with their
+    body as sent, unless ``history`` is false.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, token=None, latency=0.0, error_rate=0.0, error_status=503, retry_after=None,
+                 encodings=ENCODINGS, packages=None, host='127.0.0.1', port=0, seed=None, history=True):
+        HTTPServer.__init__(self, (host, port), FakeHandler)
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.encodings = encodings
+        self.releases = dict((name.lower(), releases if isinstance(releases, list) else [releases])
+                             for name, releases in (packages or {}).items())
+        self.packages = dict((name, latest(releases)) for name, releases in self.releases.items())
+        self.failures = []
+        self.requests = 0
+        self.history = [] if history else None
+        self.repositories = {}
+        self.thread = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d%s' % (self.server_address[0], self.server_address[1], PREFIX)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, request):
+        with self._lock:
+            self.requests += 1
+            if self.history is not None:
+                self.history.append(request)
+
+    def failure(self):
+        with self._lock:
+            if self.failures:
+                return self.failures.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def failure_headers(self):
+        return {} if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+
+    def repository(self, method, body, headers, repository):
+        with self._lock:
+            if method == 'PUT':
+                settings = json.loads(body.decode('utf-8')) if body else {}
+                state = self.repositories.setdefault(repository, {'branches': {}, 'tags': {}, 'sites': {}})
+                state['private'] = settings.get('private', state.get('private', True))
+                return 200, {'name': repository, 'private': state['private']}
+            if method == 'DELETE':
+                if self.repositories.pop(repository, None) is None:
+                    raise HTTPFailure(404, 'repository %s not found' % repository)
+                return 204, None
+        raise HTTPFailure(405, 'method not allowed')
+
+    def reference(self, method, body, headers, repository, kind, name):
+        if method == 'PUT':
+            if kind == 'sites':
+                content = body.decode('utf-8')
+            else:
+                content = dict((f['path'], base64.b64decode(f['content'])) for f in json.loads(body.decode('utf-8')))
+        with self._lock:
+            state = self.repositories.get(repository)
+            if state is None:
+                raise HTTPFailure(404, 'repository %s not found' % repository)
+            references = state[kind]
+            if method == 'PUT':
+                etag = headers.get('If-None-Match')
+                if etag and name in references and references[name][1] == etag:
+                    raise HTTPFailure(412, 'not modified')
+                references[name] = (content, etag)
+                return 200, {'name': name}
+            if method == 'DELETE':
+                if references.pop(name, None) is None:
+                    raise HTTPFailure(404, '%s %s not found' % (kind[:-1], name))
+                return 204, None
+        raise HTTPFailure(405, 'method not allowed')
+
+    def reference_content(self, repository, kind, name):
+        """Files (a dict of bytes) of a branch or tag, or text of a site."""
+        with self._lock:
+            return self.repositories[repository][kind][name][0]
+
+    def requirements(self, method, body, headers, **kwargs):
+        if method != 'POST':
+            raise HTTPFailure(405, 'method not allowed')
+        fields = _multipart(headers.get('Content-Type'), body)
+        if 'file' not in fields:
+            raise HTTPFailure(400, 'missing file')
+        return 200, [self.requirement(line) for line in fields['file'].decode('utf-8', 'replace').splitlines()
+                     if _requirement_re.match(line) and not line.lstrip().startswith('-')]
+
+    def dump_packages(self, method, body, headers, **kwargs):
+        if method != 'GET':
+            raise HTTPFailure(405, 'method not allowed')
+        return 200, self.releases
+
+    def requirement(self, line):
+        match = _requirement_re.match(line)
+        name, specs = match.group('name'), match.group('specs').strip()
+        version = self.packages.get(name.lower())
+        return {
+            'package': {'name': name},
+            'specs': specs,
+            'latest': {'version': version or ''},
+            'status': status(specs, version),
+        }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m requires_io.server', description=__doc__.splitlines()[0])
+    parser.add_argument('-p', '--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('-t', '--token', help='only accept this API token (default: any)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each reply')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='ratio of requests failing with 503')
+    args = parser.parse_args(args)
+    server = FakeServer(token=args.token, latency=args.latency, error_rate=args.error_rate, port=args.port,
+                        history=False)
+    print('serving %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
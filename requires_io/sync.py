@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Apply a whole plan of repository, branch, tag and site updates in one process.
+
+The plan is a JSON manifest::
+
+    {
+        "repositories": {
+            "my-repo": {
+                "private": true,
+                "branches": {"master": ["src/", "requirements/*.txt"]},
+                "tags": {"v1.0": ["release/"]},
+                "sites": ["web-1"]
+            }
+        }
+    }
+
+``private`` is optional (the repository settings are left as is when it is
+missing), path globs are relative to the manifest file and sites report the
+environment of the current interpreter.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requires_io.commands import GlobType, NameType, _to_urls
+from requires_io.consts import WALK
+from requires_io.discovery import DiscoveryCache
+
+log = logging.getLogger(__name__)
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+class Operation(object):
+    def __init__(self, kind, repository, name, func, *args):
+        self.kind = kind
+        self.repository = repository
+        self.name = name
+        self.func = func
+        self.args = args
+
+    @property
+    def label(self):
+        if self.name is None:
+            return '%s %s' % (self.kind, self.repository)
+        return '%s %s/%s' % (self.kind, self.repository, self.name)
+
+    def __call__(self, api):
+        return self.func(api, *self.args)
+
+
+class Result(object):
+    def __init__(self, operation, duration, error=None):
+        self.operation = operation
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _discover(api, patterns, discovery, discovery_cache):
+    glob_type = GlobType(mode=discovery, cache=DiscoveryCache() if discovery_cache else None, tracer=api.tracer)
+    with api.metrics.phase('discovery'):
+        found = [glob_type(pattern) for pattern in patterns]
+    with api.metrics.phase('mapping'):
+        return _to_urls(*found)
+
+
+def _update_repository(api, repository, private):
+    api.update_repository(repository, private)
+
+
+def _update_branch(api, repository, name, patterns, discovery, discovery_cache):
+    api.update_branch(repository, name, _discover(api, patterns, discovery, discovery_cache))
+
+
+def _update_tag(api, repository, name, patterns, discovery, discovery_cache):
+    api.update_tag(repository, name, _discover(api, patterns, discovery, discovery_cache))
+
+
+def _update_site(api, repository, name):
+    api.update_site(repository, name)
+
+
+def _check_name(value, what):
+    try:
+        return NameType()(value)
+    except argparse.ArgumentTypeError as e:
+        raise ValueError('invalid %s name %r: %s' % (what, value, e))
+
+
+def _check_mapping(value, what):
+    if not isinstance(value, dict):
+        raise ValueError('%s must be an object, not %s' % (what, json.dumps(value)))
+    return value
+
+
+def _check_strings(value, what):
+    if not isinstance(value, list) or not all(isinstance(item, _string_types) for item in value):
+        raise ValueError('%s must be a list of strings, not %s' % (what, json.dumps(value)))
+    return value
+
+
+def _check_boolean(value, what):
+    if not isinstance(value, bool):
+        raise ValueError('%s must be true or false, not %s' % (what, json.dumps(value)))
+    return value
+
+
+def load_manifest(path, discovery=WALK, discovery_cache=False):
+    """Return the stages of operations described by the manifest at ``path``.
+
+    Repository settings are applied in a first stage, before any of their
+    branches, tags or sites are updated.
+    """
+    with open(path, 'rb') as f:
+        manifest = json.loads(f.read().decode('utf-8'))
+    root = os.path.dirname(os.path.abspath(path))
+    repositories, references = [], []
+    specs = _check_mapping(_check_mapping(manifest, 'manifest').get('repositories', {}), 'repositories')
+    for repository, spec in sorted(specs.items()):
+        _check_name(repository, 'repository')
+        _check_mapping(spec, 'repository %s' % repository)
+        if 'private' in spec:
+            repositories.append(Operation('repository', repository, None, _update_repository,
+                                          repository, _check_boolean(spec['private'], 'private of %s' % repository)))
+        for kind, key, func in (('branch', 'branches', _update_branch), ('tag', 'tags', _update_tag)):
+            for name, patterns in sorted(_check_mapping(spec.get(key, {}), '%s of %s' % (key, repository)).items()):
+                _check_name(name, kind)
+                _check_strings(patterns, 'paths of %s %s' % (kind, name))
+                patterns = [os.path.join(root, pattern) for pattern in patterns]
+                references.append(Operation(kind, repository, name, func,
+                                            repository, name, patterns, discovery, discovery_cache))
+        for name in _check_strings(spec.get('sites', []), 'sites of %s' % repository):
+            _check_name(name, 'site')
+            references.append(Operation('site', repository, name, _update_site, repository, name))
+    return [stage for stage in (repositories, references) if stage]
+
+
+def _execute(api, operation):
+    start = time.time()
+    try:
+        with api.tracer.span(operation.label, cat='sync'):
+            operation(api)
+    except Exception as e:
+        result = Result(operation, time.time() - start, e)
+        log.error('FAILED %s (%.2fs): %s', operation.label, result.duration, e)
+    else:
+        result = Result(operation, time.time() - start)
+        log.info('ok     %s (%.2fs)', operation.label, result.duration)
+    return result
+
+
+def run(api, stages, workers=8):
+    """Run each stage of operations on a pool of ``workers`` threads sharing ``api``."""
+    start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for operations in stages:
+            results.extend(executor.map(lambda operation: _execute(api, operation), operations))
+    elapsed = time.time() - start
+    failures = len([result for result in results if not result.ok])
+    log.info('%d operations, %d failed in %.2fs (%.1f ops/s)',
+             len(results), failures, elapsed, len(results) / elapsed if elapsed else 0.0)
+    return results
@@ -1,15 +1,45 @@
 # -*- coding: utf-8 -*-
+import base64
 import codecs
 import contextlib
+import errno
+import json
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
+import time
+import threading
 import unittest
+import zlib
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
 
 from requests.exceptions import HTTPError
 from requests.status_codes import codes
 
-from requires_io.commands import glob_type_re, GlobType, main, _to_urls
+from requires_io.agent import SiteAgent, diff
+from requires_io.api import RequiresAPI
+from requires_io.cache import Manifest, RequirementsCache
+from requires_io.commands import glob_type_re, Commands, GlobType, main, _to_urls
+from requires_io.draw import draw, write_header, write_rows
+from requires_io.consts import GIT
+from requires_io.discovery import _walk, discover, discover_git, DiscoveryCache
+from requires_io.freeze import environment, find_environments, FreezePayload
+from requires_io.index import PackageIndex, load_dump
+from requires_io.payload import ReferencePayload, iter_json_array
+from requires_io.scheduler import AIMDLimiter, RetryPolicy, Scheduler, parse_retry_after
+from requires_io.server import FakeServer
+from requires_io import parsers
+from requires_io import sync, versions, watch
+
+if sys.version_info >= (3, 7):
+    # collected from here: the asyncio tests do not even compile on older versions
+    from requires_io.tests_async import AsyncTestCase  # noqa: F401
 
 
 class Repository(object):
@@ -117,8 +147,706 @@ class TestCase(unittest.TestCase):
                 j(repository.root, 'requirements', 'prod.txt'): j('requirements', 'prod.txt'),
             }, j(repository.root, '*', '*.txt'))
 
+    def test_session_reuse(self):
+        with FakeServer(token='1234') as server:
+            with RequiresAPI('1234', base_url=server.url) as api:
+                api.update_repository('foo', True)
+                api.update_tag('foo', 'baz', {})
+                api.update_site('foo', 'qux', data='six==1.11.0\n')
+                api.delete_tag('foo', 'baz')
+                api.delete_site('foo', 'qux')
+                api.update_branch('foo', 'bar', {os.path.abspath(__file__): 'tests.py'})
+                api.update_repository('foo', False)
+            self.assertEquals(1, len(set(request.client for request in server.history)))
+            self.assertEquals(['tests.py'], list(server.reference_content('foo', 'branches', 'bar')))
+
+    def test_reference_payload(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            repository.write('setup.py', 'x' * 1000)
+            repository.write(j('requirements', 'prod.txt'), u'caf\xe9==1.0', encoding='utf-8')
+            paths = _to_urls(GlobType()(repository.root))
+            expected = sorted([
+                {'path': 'setup.py', 'content': base64.b64encode(b'x' * 1000 + b'\n').decode('utf-8')},
+                {'path': 'requirements/prod.txt',
+                 'content': base64.b64encode(u'caf\xe9==1.0\n'.encode('utf-8')).decode('utf-8')},
+            ], key=lambda f: f['path'])
+            for chunk_size in (3, 10, 1024):
+                payload = ReferencePayload(paths, chunk_size=chunk_size)
+                chunks = list(payload)
+                self.assertTrue(all(len(chunk) < 2 * max(chunk_size, 64) for chunk in chunks))
+                self.assertEquals(expected, json.loads(b''.join(chunks).decode('utf-8')))
+            # traced, files are still read one block at a time
+            spans = []
+
+            @contextlib.contextmanager
+            def span(name, cat, **args):
+                spans.append(name)
+                yield
+
+            chunks = iter(ReferencePayload(paths, chunk_size=3, span=span))
+            body = []
+            while not spans:
+                body.append(next(chunks))
+            self.assertEquals(['encode requirements/prod.txt'], spans)
+            body.extend(chunks)
+            self.assertEquals(expected, json.loads(b''.join(body).decode('utf-8')))
+            self.assertTrue(len(spans) > 300)
+
+    def test_skip_unchanged(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234') as server:
+            repository.write('setup.py', 'hello')
+            paths = _to_urls(GlobType()(repository.root))
+            api = RequiresAPI('1234', base_url=server.url, manifest=Manifest(os.path.join(repository.root, 'm.json')))
+            api.update_repository('foo', True)
+            api.update_branch('foo', 'bar', paths)
+            api.update_branch('foo', 'bar', paths)
+            api.update_tag('foo', 'bar', paths)
+            self.assertEquals(3, len(server.history))
+            self.assertEquals(server.history[1].headers['If-None-Match'], server.history[2].headers['If-None-Match'])
+            repository.write('setup.py', 'world')
+            api.update_branch('foo', 'bar', paths)
+            self.assertEquals(4, len(server.history))
+            api.delete_repository('foo')
+            api.update_repository('foo', True)
+            api.update_branch('foo', 'bar', paths)
+            self.assertEquals(7, len(server.history))
+            # already uploaded by another client: not modified, then skipped
+            other = RequiresAPI('1234', base_url=server.url,
+                                manifest=Manifest(os.path.join(repository.root, 'other.json')))
+            other.update_branch('foo', 'bar', paths)
+            other.update_branch('foo', 'bar', paths)
+            self.assertEquals(8, len(server.history))
+            # concurrent writers, as in sync, keep all the entries
+            manifest = Manifest(os.path.join(repository.root, 'concurrent.json'))
+            threads = [threading.Thread(target=manifest.set, args=('ref%d' % i, {'setup.py': str(i)}))
+                       for i in range(40)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEquals(40, len(manifest._load()))
+
+    def test_compress(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234') as server:
+            repository.write('setup.py', 'x' * 1000)
+            repository.write('requirements.txt', 'six')
+            paths = _to_urls(GlobType()(repository.root))
+            expected = b''.join(ReferencePayload(paths))
+            api = RequiresAPI('1234', base_url=server.url, compress='gzip')
+            api.update_repository('foo', True)
+            api.update_branch('foo', 'bar', paths)
+            api.update_site('foo', 'small', paths=[])
+            history = server.history[1:]
+            self.assertEquals('gzip', history[0].headers['Content-Encoding'])
+            self.assertEquals(expected, zlib.decompress(history[0].body, 16 + zlib.MAX_WBITS))
+            self.assertEquals(None, history[1].headers.get('Content-Encoding'))
+            server.encodings = ()
+            api = RequiresAPI('1234', base_url=server.url, compress='deflate')
+            api.update_tag('foo', 'baz', paths)
+            api.update_tag('foo', 'baz', paths)
+            history = server.history[3:]
+            self.assertEquals(['deflate', None, None], [request.headers.get('Content-Encoding') for request in history])
+            self.assertEquals(expected, zlib.decompress(history[0].body))
+            self.assertEquals([expected] * 2, [request.body for request in history[1:]])
+
+    def test_retry(self):
+        delays = []
+        with FakeServer(retry_after=0) as server:
+            scheduler = Scheduler(RetryPolicy(retries=2), AIMDLimiter(maximum=8), sleep=delays.append)
+            api = RequiresAPI('1234', base_url=server.url, scheduler=scheduler)
+            api.update_repository('foo', True)
+            api.update_branch('foo', 'bar', {})
+            server.failures = [codes.TOO_MANY_REQUESTS, codes.SERVICE_UNAVAILABLE]
+            api.delete_branch('foo', 'bar')
+            self.assertEquals([0.0, 0.0], delays)
+            self.assertEquals(5, server.requests)
+            self.assertEquals(2, scheduler.limiter.limit // 1)
+            server.failures = [codes.BAD_GATEWAY] * 3
+            self.assertRaiseForStatus(codes.BAD_GATEWAY, api.delete_tag, 'foo', 'baz')
+            server.failures = [codes.SERVICE_UNAVAILABLE]
+            self.assertRaiseForStatus(codes.SERVICE_UNAVAILABLE, api.get_requirements, __file__)
+            self.assertEquals(9, server.requests)
+            # waiting longer than the policy allows: the throttled response is returned as is
+            server.retry_after = 300
+            server.failures = [codes.TOO_MANY_REQUESTS]
+            self.assertRaiseForStatus(codes.TOO_MANY_REQUESTS, api.delete_branch, 'foo', 'bar')
+            self.assertEquals(10, server.requests)
+            self.assertEquals([0.0] * 4, delays)
+        limiter = AIMDLimiter(maximum=4, initial=2)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release()
+        self.assertEquals(4, limiter.limit)
+        self.assertEquals(5.0, parse_retry_after('5'))
+        self.assertEquals(30.0, parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=1445412480))
+        self.assertEquals(None, parse_retry_after('soon'))
+        self.assertTrue(0 <= RetryPolicy(backoff=1, max_backoff=3).delay(5) <= 3)
+        self.assertEquals(2, RetryPolicy(max_backoff=3).delay(0, retry_after=2))
+        self.assertEquals(None, RetryPolicy(max_backoff=3).delay(0, retry_after=300))
+
+    def test_sync(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234') as server:
+            repository.write('setup.py', 'hello')
+            repository.write(os.path.join('requirements', 'prod.txt'), 'hello')
+            repository.write('sync.json', json.dumps({'repositories': {
+                'foo': {'private': True, 'branches': {'master': ['.'], 'dev': ['missing/']}, 'tags': {'v1': ['*.py']}},
+                'bar': {'tags': {'v2': ['requirements']}},
+            }}))
+            stages = sync.load_manifest(os.path.join(repository.root, 'sync.json'))
+            self.assertEquals([['repository foo'], ['tag bar/v2', 'branch foo/dev', 'branch foo/master', 'tag foo/v1']],
+                              [[operation.label for operation in stage] for stage in stages])
+            with RequiresAPI('1234', base_url=server.url) as api:
+                api.update_repository('bar', False)
+                results = sync.run(api, stages, workers=4)
+            self.assertEquals([True, True, False, True, True], [result.ok for result in results])
+            self.assertEquals(5, server.requests)
+            self.assertEquals({'requirements/prod.txt': b'hello\n'}, server.reference_content('bar', 'tags', 'v2'))
+            for manifest in ({'repositories': {'foo': ['.']}}, {'repositories': {'foo': {'branches': ['.']}}},
+                             {'repositories': {'foo': {'branches': {'master': 'requirements.txt'}}}},
+                             {'repositories': {'foo': {'tags': {'v1': [1]}}}},
+                             {'repositories': {'foo': {'sites': 'web'}}},
+                             {'repositories': {'foo': {'private': 'false'}}}, ['foo']):
+                repository.write('sync.json', json.dumps(manifest))
+                self.assertRaises(ValueError, sync.load_manifest, os.path.join(repository.root, 'sync.json'))
+
+    def test_discover(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            for folder in ('', 'a', j('a', 'b'), j('a', 'CVS'), j('a', '.git'), 'c'):
+                repository.write(j(folder, 'setup.py'), 'hello')
+                repository.write(j(folder, 'README'), 'hello')
+                repository.write(j(folder, 'requirements', 'prod.txt'), 'hello')
+            expected = _walk(repository.root)
+            self.assertEquals(8, len(expected))
+            self.assertEquals(expected, discover(repository.root, workers=1))
+            self.assertEquals(expected, discover(repository.root, workers=4))
+
+    def test_discovery_cache(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            for folder in ('', 'a', j('a', 'b'), 'c'):
+                repository.write(j(folder, 'requirements', 'prod.txt'), 'hello')
+            past = time.time() - 60
+            for root, dirs, files in os.walk(repository.root):
+                os.utime(root, (past, past))
+            cache = DiscoveryCache(j(repository.root, '..', 'cache.json'))
+            expected = discover(repository.root, workers=1)
+            self.assertEquals(expected, discover(repository.root, workers=1, cache=cache))
+            self.assertEquals((0, 8), (cache.hits, cache.misses))
+            cache = DiscoveryCache(cache.path)
+            self.assertEquals(expected, discover(repository.root, workers=4, cache=cache))
+            self.assertEquals((8, 0), (cache.hits, cache.misses))
+            repository.write(j('a', 'b', 'requirements', 'test.txt'), 'hello')
+            repository.write(j('c', 'd', 'setup.py'), 'hello')
+            cache = DiscoveryCache(cache.path)
+            self.assertEquals(discover(repository.root, workers=1), discover(repository.root, cache=cache))
+            self.assertEquals((6, 3), (cache.hits, cache.misses))
+
+    def test_discover_git(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            repository.write('setup.py', 'hello')
+            repository.write(j('a', 'Requirements', 'prod.txt'), 'hello')
+            repository.write(j('a', 'README'), 'hello')
+            repository.write(j('a', 'removed', 'setup.py'), 'hello')
+            self.assertEquals(None, discover_git(repository.root))
+            self.assertPaths(_walk(repository.root), repository.root)
+            try:
+                subprocess.check_call(['git', 'init', '-q', repository.root])
+                subprocess.check_call(['git', 'add', '.'], cwd=repository.root)
+            except OSError:
+                self.skipTest('git not available')
+            repository.write(j('node_modules', 'x', 'requirements.txt'), 'hello')
+            os.remove(j(repository.root, 'a', 'removed', 'setup.py'))
+            self.assertEquals({
+                j(repository.root, 'setup.py'): 'setup.py',
+                j(repository.root, 'a', 'Requirements', 'prod.txt'): j('Requirements', 'prod.txt'),
+            }, GlobType(mode=GIT)(j(repository.root, 'a', '..')))
+            requirements = j(repository.root, 'a', 'Requirements')
+            self.assertEquals({j(requirements, 'prod.txt'): j('Requirements', 'prod.txt')}, discover_git(requirements))
+
+    def test_requirements_cache(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234', packages={'requests': '2.18.4'}) as server:
+            path = os.path.join(repository.root, 'requirements.txt')
+            repository.write('requirements.txt', 'requests==2.0.0')
+            cache = RequirementsCache(os.path.join(repository.root, 'cache'))
+            api = RequiresAPI('1234', base_url=server.url, requirements_cache=cache)
+            requirements = api.get_requirements(path)
+            self.assertEquals(['outdated'], [requirement['status'] for requirement in requirements])
+            self.assertEquals(requirements, api.get_requirements(path))
+            self.assertEquals(1, server.requests)
+            api.get_requirements(path, 'requirements')
+            repository.write('requirements.txt', 'requests==2.1.0')
+            api.get_requirements(path)
+            self.assertEquals(3, server.requests)
+            cache.ttl = 0
+            api.get_requirements(path)
+            self.assertEquals(4, server.requests)
+            cache.ttl = 3600
+            cache.max_size = 1
+            cache.set('foo', [])
+            self.assertEquals(['foo.json'], [name for name in os.listdir(cache.path) if name.endswith('.json')])
+            scans = []
+            evict = cache._evict
+            cache._evict = lambda keep: scans.append(keep) or evict(keep)
+            cache.max_size = 1000
+            for i in range(10):
+                cache.set('bar%d' % i, ['x' * 20])
+            self.assertEquals(0, len(scans))
+            cache.set('bar0', ['x' * 20])
+            self.assertEquals(0, len(scans))
+            cache.set('baz', ['x' * 800])
+            self.assertEquals(1, len(scans))
+            sizes = dict((name, os.path.getsize(os.path.join(cache.path, name)))
+                         for name in os.listdir(cache.path) if name.endswith('.json'))
+            self.assertTrue('baz.json' in sizes and 'foo.json' not in sizes)
+            self.assertEquals(sum(sizes.values()), cache._load_index()[0])
+            self.assertTrue(sum(sizes.values()) <= 1000)
+            for i, content in enumerate(('{"data": []}', '{"created": 1e12}', '[]', '{"created": "now", "data": []}',
+                                         'not json')):
+                repository.write(os.path.join('cache', 'bad%d.json' % i), content)
+                self.assertEquals(None, cache.get('bad%d' % i))
+                self.assertFalse(os.path.exists(cache._entry_path('bad%d' % i)))
+
+    def test_parse(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234', packages={'requests': '2.18.4'}) as server:
+            repository.write('setup.py', 'hello')
+            repository.write(j('requirements', 'prod.txt'), 'requests==2.0.0')
+            repository.write(j('requirements', 'test.txt'), 'requests==2.0.0')
+            commands = Commands()
+            args = commands.parser.parse_args(['parse', '-t', '1234', '--ordered', '-f', 'jsonl', repository.root,
+                                               j(repository.root, 'requirements', '*.txt')])
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                commands.parse(RequiresAPI('1234', base_url=server.url), args)
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            self.assertEquals([
+                j(repository.root, 'requirements', 'prod.txt'),
+                j(repository.root, 'requirements', 'test.txt'),
+                j(repository.root, 'setup.py'),
+            ], [json.loads(line)['path'] for line in output.splitlines()])
+            self.assertEquals(['outdated'] * 2, [json.loads(line)['status'] for line in output.splitlines()[:2]])
+            self.assertEquals(3, server.requests)
+            stderr, sys.stderr = sys.stderr, StringIO()
+            try:
+                self.assertRaises(SystemExit, commands.parser.parse_args, ['parse', '-j', '0', repository.root])
+            finally:
+                sys.stderr = stderr
+            try:
+                subprocess.check_call(['git', 'init', '-q', repository.root])
+                subprocess.check_call(['git', 'add', 'setup.py'], cwd=repository.root)
+            except OSError:
+                self.skipTest('git not available')
+            args = commands.parser.parse_args(['parse', '--discovery', 'git', repository.root])
+            self.assertEquals([j(repository.root, 'setup.py')], commands.parse_paths(args))
+
+    def test_draw(self):
+        requirements = [
+            {'package': {'name': 'requests'}, 'specs': '>=2.0,<3', 'latest': {'version': '2.18.4'},
+             'status': 'up-to-date'},
+            {'package': {'name': 'six'}, 'specs': '==1.10.0', 'latest': {'version': '1.11.0'}, 'status': 'outdated'},
+        ]
+        stream = StringIO()
+        draw(iter(requirements), stream=stream)
+        self.assertEquals([
+            '========  ===========  ======  ==========',
+            'Package   Requirement  Latest  Status    ',
+            '========  ===========  ======  ==========',
+            'requests  >=2.0,<3     2.18.4  up-to-date',
+            'six       ==1.10.0     1.11.0  outdated  ',
+            '========  ===========  ======  ==========',
+        ], stream.getvalue().splitlines())
+        stream = StringIO()
+        draw(iter(requirements), stream=stream, widths=(6, 6, 6, 6))
+        self.assertEquals(['req...  >=2...  2.18.4  up-...', 'six     ==1...  1.11.0  out...'],
+                          stream.getvalue().splitlines()[3:5])
+        for output_format, expected in (
+                ('csv', ['path,package,specs,latest,status', 'r.txt,requests,">=2.0,<3",2.18.4,up-to-date']),
+                ('tsv', ['path\tpackage\tspecs\tlatest\tstatus', 'r.txt\trequests\t>=2.0,<3\t2.18.4\tup-to-date'])):
+            stream = StringIO()
+            write_header(output_format, stream)
+            write_rows(iter(requirements), output_format, stream, 'r.txt')
+            self.assertEquals(expected, stream.getvalue().splitlines()[:2])
+
+    def test_stream_requirements(self):
+        body = json.dumps([{'package': {'name': u'caf\xe9'}}, {'specs': '>=1.0'}, 12, None]).encode('utf-8')
+        for size in (1, 5, 1024):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEquals(json.loads(body.decode('utf-8')), list(iter_json_array(chunks)))
+        self.assertRaises(ValueError, list, iter_json_array([b'[{"a": 1}']))
+        self.assertRaises(ValueError, list, iter_json_array([b'{"a": 1}']))
+        repository = Repository('foo')
+        with repository.context(), FakeServer(packages={'six': '1.11.0'}) as server:
+            path = os.path.join(repository.root, 'requirements.txt')
+            repository.write('requirements.txt', '\n'.join('six==1.%d.0' % i for i in range(200)))
+            api = RequiresAPI('1234', base_url=server.url,
+                              requirements_cache=RequirementsCache(os.path.join(repository.root, 'cache')))
+            requirements = api.get_requirements(path, stream=True)
+            self.assertEquals(0, server.requests)
+            self.assertEquals({'package': {'name': 'six'}, 'specs': '==1.0.0', 'latest': {'version': '1.11.0'},
+                               'status': 'outdated'}, next(requirements))
+            self.assertEquals(200, 1 + len(list(requirements)))
+            self.assertEquals(list(api.get_requirements(path, stream=True)), api.get_requirements(path))
+            self.assertEquals(1, server.requests)
+            commands = Commands()
+            args = commands.parser.parse_args(['parse', '-t', '1234', '-f', 'csv', path, path])
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                commands.parse(RequiresAPI('1234', base_url=server.url), args)
+                output = sys.stdout.getvalue().splitlines()
+            finally:
+                sys.stdout = stdout
+            self.assertEquals(['path,package,specs,latest,status', '%s,six,==1.0.0,1.11.0,outdated' % path],
+                              output[:2])
+            self.assertEquals(201, len(output))
+
+    def test_local_parsers(self):
+        j = os.path.join
+
+        def specs(parsed):
+            return [(r['package']['name'], r['specs']) for r in parsed.requirements]
+
+        parsed = parsers.parse('-r base.txt\n# comment\nDjango >= 1.11, <2.0  # pinned\ncelery[redis,auth]==4.1\n'
+                               'pytest==3.0; python_version < "3"\n-e git+https://x/y.git#egg=foo\n'
+                               'requests \\\n  >=2.0 --hash=sha256:abcd\n--index-url https://pypi\n',
+                               parsers.REQUIREMENTS, j('req', 'prod.txt'))
+        self.assertEquals([('Django', '>=1.11,<2.0'), ('celery', '==4.1'), ('pytest', '==3.0'), ('foo', ''),
+                           ('requests', '>=2.0')], specs(parsed))
+        self.assertEquals(['auth', 'redis'], parsed.requirements[1]['extras'])
+        self.assertEquals('python_version < "3"', parsed.requirements[2]['marker'])
+        self.assertEquals(7, parsed.requirements[4]['line'])
+        self.assertEquals([j('req', 'base.txt')], parsed.includes)
+        parsed = parsers.parse('from setuptools import setup\nrequires = ["six"]\nrequires.append("attrs>=17")\n'
+                               'setup(install_requires=requires + ["idna"], extras_require={"s": ["pyOpenSSL"]})\n',
+                               parsers.SETUP)
+        self.assertEquals([('six', ''), ('attrs', '>=17'), ('idna', ''), ('pyOpenSSL', '')], specs(parsed))
+        self.assertEquals('extras_require:s', parsed.requirements[3]['section'])
+        parsed = parsers.parse('[testenv]\ndeps =\n    py27: mock\n    -r{toxinidir}/test.txt\n    {[base]deps}\n'
+                               '[testenv:lint]\ndeps = flake8>=3\n', parsers.TOX, j('src', 'tox.ini'))
+        self.assertEquals([('mock', ''), ('flake8', '>=3')], specs(parsed))
+        self.assertEquals([j('src', 'test.txt')], parsed.includes)
+        parsed = parsers.parse('[buildout]\nextends = base.cfg\neggs = zope.interface\n[versions]\nsix = 1.10.0\n',
+                               parsers.BUILDOUT)
+        self.assertEquals([('zope.interface', ''), ('six', '==1.10.0')], specs(parsed))
+        self.assertEquals(['base.cfg'], parsed.includes)
+        self.assertRaises(ValueError, parsers.parse, '', 'pom')
+        repository = Repository('foo')
+        with repository.context():
+            repository.write(j('requirements', 'prod.txt'), '-r base.txt\nDjango==1.11\n')
+            repository.write(j('requirements', 'base.txt'), 'six==1.10.0\n-r prod.txt\n')
+            commands = Commands()
+            args = commands.parser.parse_args(['parse', '--offline', '-f', 'csv',
+                                               j(repository.root, 'requirements', 'prod.txt')])
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                commands.parse(None, args)
+                output = sys.stdout.getvalue().splitlines()
+            finally:
+                sys.stdout = stdout
+            self.assertEquals(['path,package,specs,latest,status',
+                               '%s,Django,==1.11,,' % j(repository.root, 'requirements', 'prod.txt'),
+                               '%s,six,==1.10.0,,' % j(repository.root, 'requirements', 'base.txt')], output)
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                self.assertRaises(SystemExit, commands.parse_offline,
+                                  [j(repository.root, 'missing.txt'), j(repository.root, 'requirements', 'prod.txt')],
+                                  args)
+                output = sys.stdout.getvalue().splitlines()
+            finally:
+                sys.stdout = stdout
+            self.assertEquals(['Django', 'six'], [line.split(',')[1] for line in output])
+
+    def test_package_index(self):
+        repository = Repository('foo')
+        packages = {'Django': ['1.10', '1.11.2'], 'six': '1.11.0'}
+        with repository.context(), FakeServer(token='1234', packages=packages) as server:
+            path = os.path.join(repository.root, 'index.sqlite')
+            main(['requires.io', 'refresh-index', '-t', '1234', '--api-url', server.url, '--index', path])
+            index = PackageIndex(path)
+            self.assertEquals({'django': '1.11.2'}, index.latest(['DJANGO', 'flask']))
+            self.assertEquals(['1.10', '1.11.2'], index.releases('django'))
+            requirements = parsers.parse('django==1.10\nSix==1.11.0\nflask\nzope.interface>=4\n',
+                                         parsers.REQUIREMENTS).requirements
+            self.assertEquals([('1.11.2', 'outdated'), ('1.11.0', 'up-to-date'), ('', 'unknown'), ('', 'unknown')],
+                              [(r['latest']['version'], r['status']) for r in index.annotate(requirements)])
+            repository.write('dump.json', json.dumps({'zope_interface': ['4.0', '4.4.3']}))
+            self.assertEquals(1, index.refresh(load_dump(os.path.join(repository.root, 'dump.json'))))
+            self.assertEquals({'zope-interface': '4.4.3'}, index.latest(['Zope.Interface', 'django']))
+            index.close()
+
+    def test_versions(self):
+        releases = ['1.0', '1.0.dev0', '1.0rc1', '1.0a1', '1!0.1', '1.0.post1', '1.0b2', '1.0.1', 'foo']
+        self.assertEquals(['foo', '1.0.dev0', '1.0a1', '1.0b2', '1.0rc1', '1.0', '1.0.post1', '1.0.1', '1!0.1'],
+                          sorted(releases, key=lambda release: versions.parse_version(release).key))
+        self.assertEquals('1!0.1', versions.latest(releases))
+        self.assertEquals('2.0b1', versions.latest(['2.0a1', '2.0b1']))
+        self.assertTrue(versions.parse_version('1.0') is versions.parse_version('1.0'))
+        for specs, version, expected in (
+                ('==1.0', '1.0.0', True), ('==1.0', '1.0+abc', True), ('==1.0+abc', '1.0', False),
+                ('>=1.0, <2', '2.0', False), ('~=1.4.5', '1.4.9', True), ('~=1.4', '2.0', False),
+                ('==1.*', '1.3', True), ('!=1.1.*', '1.1.0', False), ('', '3', True)):
+            self.assertEquals(expected, versions.contains(versions.parse_specifier(specs),
+                                                          versions.parse_version(version)), (specs, version))
+        self.assertEquals(['up-to-date', 'outdated', 'unknown', 'unknown', 'outdated'],
+                          versions.statuses([('<2', '1.9'), ('<2', '2.0'), ('==1.0', ''), ('=>1.0', '1.0'),
+                                             ('<2', '2.0')]))
+
+    def test_watch(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            repository.write('requirements.txt', 'six')
+            root = j(repository.root, 'requirements.txt')
+            for create in (watch.InotifyWatcher, lambda paths: watch.PollingWatcher(paths, interval=0.05)):
+                try:
+                    watcher = create([repository.root])
+                except OSError:  # no inotify
+                    continue
+                try:
+                    repository.write('notes.txt', 'hello')
+                    self.assertEquals(set(), watcher.wait(0.2))
+                    stop = threading.Event()
+                    changes = []
+                    thread = threading.Thread(target=lambda: changes.extend(watch.batches(watcher, 0.3, stop=stop)))
+                    thread.start()
+                    for i in range(3):
+                        repository.write('requirements.txt', 'six==1.%d' % i)
+                        time.sleep(0.05)
+                    time.sleep(0.6)
+                    repository.write(j('web', 'requirements', 'prod.txt'), 'attrs')
+                    time.sleep(0.6)
+                    stop.set()
+                    thread.join()
+                finally:
+                    watcher.close()
+                self.assertEquals(set([root]), changes[0])
+                self.assertEquals(2, len(changes))
+                self.assertTrue(j(repository.root, 'web') in changes[1] or
+                                j(repository.root, 'web', 'requirements', 'prod.txt') in changes[1], changes)
+
+    def test_watch_git(self):
+        j = os.path.join
+        repository = Repository('foo')
+        with repository.context():
+            repository.write(j('a', 'requirements.txt'), 'six')
+            repository.write(j('node_modules', 'x', 'setup.py'), 'hello')
+            try:
+                subprocess.check_call(['git', 'init', '-q', repository.root])
+                subprocess.check_call(['git', 'add', j('a', 'requirements.txt')], cwd=repository.root)
+            except OSError:
+                self.skipTest('git not available')
+            try:
+                watcher = watch.InotifyWatcher([repository.root], GIT)
+            except OSError:
+                self.skipTest('inotify not available')
+            try:
+                folders = set(folder for folder, unused_requirements, unused_recursive in watcher.watches.values())
+                self.assertEquals(set([repository.root, j(repository.root, 'a'), j(repository.root, '.git')]), folders)
+                repository.write(j('node_modules', 'x', 'setup.py'), 'changed')
+                self.assertEquals(set(), watcher.wait(0.2))
+                repository.write(j('b', 'setup.py'), 'hello')
+                subprocess.check_call(['git', 'add', j('b', 'setup.py')], cwd=repository.root)
+                self.assertEquals(set([j(repository.root, '.git', 'index')]), watcher.wait(0.2))
+                self.assertTrue(j(repository.root, 'b') in set(folder for folder, unused_requirements, unused_recursive
+                                                               in watcher.watches.values()))
+
+                def fail(root):
+                    raise OSError(errno.ENOSPC, 'No space left on device')
+
+                watcher.close()
+                watcher = watch.InotifyWatcher([repository.root])
+                watcher._add_tree = fail
+                os.makedirs(j(repository.root, 'c'))
+                self.assertEquals(set([j(repository.root, 'c')]), watcher.wait(0.2))
+                self.assertTrue(isinstance(watcher.fallback, watch.PollingWatcher))
+                repository.write(j('c', 'setup.py'), 'hello')
+                watcher.fallback.interval = 0.05
+                self.assertEquals(set([j(repository.root, 'c', 'setup.py')]), watcher.wait(1))
+            finally:
+                watcher.close()
+
+    def test_freeze(self):
+        j = os.path.join
+        repository = Repository('site-packages')
+        with repository.context(), FakeServer(token='1234') as server:
+            repository.write(j('requests-2.18.4.dist-info', 'METADATA'),
+                             'Metadata-Version: 2.0\nName: requests\nVersion: 2.18.4\n\nName: not-me')
+            repository.write(j('Django-1.11.egg-info', 'PKG-INFO'), 'Name: Django\nVersion: 1.11')
+            repository.write('six-1.11.0-py2.7.egg-info', 'Name: six\nVersion: 1.11.0')
+            repository.write(j('pip-9.0.1.dist-info', 'METADATA'), 'Name: pip\nVersion: 9.0.1')
+            repository.write(j('broken.dist-info', 'METADATA'), 'Name: broken')
+            other = j(repository.root, '..', 'other')
+            os.makedirs(j(other, 'requests-1.0.dist-info'))
+            with open(j(other, 'requests-1.0.dist-info', 'METADATA'), 'w') as f:
+                f.write('Name: Requests\nVersion: 1.0\n')
+            payload = FreezePayload([repository.root, other], chunk_size=1)
+            self.assertEquals([b'Django==1.11\n', b'requests==2.18.4\n', b'six==1.11.0\n'], list(payload))
+            with RequiresAPI('1234', base_url=server.url) as api:
+                api.update_repository('foo', True)
+                api.update_site('foo', 'bar')
+            self.assertTrue(server.reference_content('foo', 'sites', 'bar'))
+
+    def test_update_site_envs(self):
+        j = os.path.join
+        repository = Repository('envs')
+        with repository.context(), FakeServer(token='1234') as server:
+            for env in ('web', j('workers', 'celery')):
+                repository.write(j(env, 'pyvenv.cfg'), 'home = /usr/bin')
+                repository.write(j(env, 'bin', 'python'), '')
+                repository.write(j(env, 'lib', 'python3.6', 'site-packages', 'six-1.11.0.dist-info', 'METADATA'),
+                                 'Name: six\nVersion: 1.11.0')
+            web = j(repository.root, 'web')
+            site = j(web, 'lib', 'python3.6', 'site-packages')
+            self.assertEquals([web, j(repository.root, 'workers', 'celery')], find_environments(repository.root))
+            self.assertEquals((web, [site]), environment(j(web, 'bin', 'python')))
+            self.assertEquals((web, [site]), environment(web))
+            self.assertEquals((web, [site]), environment(site))
+            commands = Commands()
+            args = commands.parser.parse_args(['update-site', '-t', '1234', '-r', 'foo', '-n', 'host',
+                                               '--envs-root', repository.root])
+            api = RequiresAPI('1234', base_url=server.url)
+            api.update_repository('foo', True)
+            commands.update_site(api, args)
+            sites = server.repositories['foo']['sites']
+            self.assertEquals({'host-celery': 'six==1.11.0\n', 'host-web': 'six==1.11.0\n'},
+                              dict((name, server.reference_content('foo', 'sites', name)) for name in sites))
+
+    def test_site_agent(self):
+        j = os.path.join
+        repository = Repository('agent')
+        with repository.context(), FakeServer(token='1234') as server:
+            site = j(repository.root, 'site-packages')
+            repository.write(j(site, 'six-1.11.0.dist-info', 'METADATA'), 'Name: six\nVersion: 1.11.0')
+            api = RequiresAPI('1234', base_url=server.url)
+            api.update_repository('foo', True)
+            state = Manifest(j(repository.root, 'sites.json'))
+            agent = SiteAgent(api, 'foo', {'host': [site]}, interval=60, jitter=0, min_interval=0, state=state,
+                              racy_window=0)
+            self.assertTrue(agent.check('host', [site]))
+            self.assertEquals('six==1.11.0\n', server.reference_content('foo', 'sites', 'host'))
+            self.assertEquals(['%s foo/host' % server.url], list(state._load()))
+            requests = server.requests
+            agent.check_all()
+            # restarted with the same snapshots
+            SiteAgent(api, 'foo', {'host': [site]}, state=state, racy_window=0).check_all()
+            self.assertEquals(requests, server.requests)
+            repository.write(j(site, 'attrs-17.4.0.dist-info', 'METADATA'), 'Name: attrs\nVersion: 17.4.0')
+            agent.check_all()
+            self.assertEquals('attrs==17.4.0\nsix==1.11.0\n', server.reference_content('foo', 'sites', 'host'))
+            agent.min_interval = 3600
+            shutil.rmtree(j(site, 'six-1.11.0.dist-info'))
+            self.assertFalse(agent.check('host', [site]))
+            self.assertEquals((2, requests + 1), (agent.uploads, server.requests))
+            self.assertEquals((['b'], ['a'], ['c']), diff({'a': '1', 'c': '1'}, {'b': '1', 'c': '2'}))
+            agent.jitter = 30
+            self.assertTrue(60 <= agent.delay() <= 90)
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires python 3.7')
+    def test_lazy_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = 'from requires_io.commands import main; main(["requires.io", "--version"])'
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code], cwd=root,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        self.assertEquals(0, process.returncode)
+        modules = set(line.split('|')[-1].strip() for line in err.decode('utf-8').splitlines())
+        heavy = set(['requests', 'urllib3', 'ssl', 'socket', 'json', 'concurrent.futures', 'subprocess',
+                     'requires_io.api', 'requires_io.discovery', 'requires_io.cache'])
+        self.assertEquals(set(), heavy & modules)
+        # offline parsing needs no HTTP client
+        code = ('import sys; from requires_io.commands import main; '
+                'main(["requires.io", "parse", "--offline", "setup.py"]); assert "requests" not in sys.modules')
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        self.assertEquals(0, process.returncode, err)
+        commands = Commands()
+        args = commands.parser.parse_args(['update-repo', '-t', '1234', '-r', 'foo', '--private'])
+        self.assertEquals(('foo', True), (args.repository, args.private))
+
+    def test_fake_server(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234', packages={'six': '1.11.0'}) as server:
+            repository.write('requirements.txt', '# pins\nsix==1.10.0\nrequests>=2.0\n-r base.txt')
+            paths = _to_urls(GlobType()(repository.root))
+            api = RequiresAPI('1234', base_url=server.url, compress='gzip', compress_threshold=0,
+                              manifest=Manifest(os.path.join(repository.root, 'm.json')),
+                              scheduler=Scheduler(sleep=lambda delay: None))
+            self.assertRaiseForStatus(codes.NOT_FOUND, api.update_branch, 'foo', 'master', paths)
+            api.update_repository('foo', True)
+            server.failures = [codes.SERVICE_UNAVAILABLE]
+            api.update_branch('foo', 'master', paths)
+            api.delete_repository('foo')
+            api.update_repository('foo', False)
+            api.update_branch('foo', 'master', paths)
+            api.update_site('foo', 'web', paths=[])
+            self.assertEquals({'requirements.txt': b'# pins\nsix==1.10.0\nrequests>=2.0\n-r base.txt\n'},
+                              server.reference_content('foo', 'branches', 'master'))
+            requirements = api.get_requirements(os.path.join(repository.root, 'requirements.txt'))
+            self.assertEquals(['outdated', 'unknown'], [r['status'] for r in requirements])
+            self.assertEquals(9, server.requests)
+            self.assertRaiseForStatus(codes.NOT_FOUND, api.delete_tag, 'foo', 'v1')
+
+    def test_metrics(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer(token='1234', retry_after=0) as server:
+            repository.write('requirements.txt', 'six==1.10.0')
+            output = os.path.join(repository.root, 'metrics', 'requires.prom')
+            args = ['-t', '1234', '--api-url', server.url, '--metrics', 'prometheus', '--metrics-output', output]
+            Commands().execute(['update-repo', '-r', 'foo', '--private'] + args)
+            server.failures = [codes.SERVICE_UNAVAILABLE]
+            commands = Commands()
+            commands.execute(['update-branch', '-r', 'foo', '-n', 'master', repository.root] + args)
+            metrics = commands.metrics.as_dict()
+            path = os.path.join(repository.root, 'requirements.txt')
+            payload = b''.join(ReferencePayload({path: 'requirements.txt'}))
+            self.assertEquals(set(['arguments', 'discovery', 'mapping', 'encoding']), set(metrics['phases']))
+            self.assertEquals(2, metrics['phases']['encoding']['count'])
+            self.assertEquals({'requests': 2, 'retries': 1, 'bytes_read': 12, 'bytes_sent': 2 * len(payload),
+                               'bytes_received': 48}, metrics['counters'])
+            self.assertEquals(2, metrics['request_seconds']['buckets']['+Inf'])
+            with open(output) as fd:
+                report = fd.read()
+            self.assertTrue('requires_io_retries_total 1\n' in report)
+            self.assertTrue('requires_io_request_duration_seconds_count 2\n' in report)
+
+    def test_trace(self):
+        repository = Repository('foo')
+        with repository.context(), FakeServer() as server:
+            repository.write(os.path.join('requirements', 'prod.txt'), 'six==1.10.0')
+            output = os.path.join(repository.root, 'trace.json')
+            args = ['-t', '1234', '--api-url', server.url]
+            Commands().execute(['update-repo', '-r', 'foo', '--private'] + args)
+            Commands().execute(['--trace', output, 'update-branch', '-r', 'foo', '-n', 'master',
+                                repository.root] + args)
+            with open(output) as fd:
+                events = json.load(fd)['traceEvents']
+            spans = [e for e in events if e['ph'] == 'X']
+            self.assertEquals(['parse arguments', 'update-branch'], [e['name'] for e in spans if e['cat'] == 'cli'])
+            self.assertEquals(['scan foo', 'scan requirements'],
+                              sorted(e['name'] for e in spans if e['cat'] == 'discovery'))
+            self.assertEquals(set(['encode requirements/prod.txt']),
+                              set(e['name'] for e in spans if e['cat'] == 'payload'))
+            self.assertEquals(['PUT repos/foo/branches/master'], [e['name'] for e in spans if e['cat'] == 'http'])
+            self.assertEquals(set(e['tid'] for e in spans), set(e['tid'] for e in events if e['ph'] == 'M'))
+
     def test_update_site(self):
-        self.assertRaiseForStatus(codes.UNAUTHORIZED, main, ['requires.io', 'update-site', '-t', '1234', '-r', 'foo'])
+        with FakeServer(token='secret') as server:
+            self.assertRaiseForStatus(codes.UNAUTHORIZED, main, ['requires.io', 'update-site', '-t', '1234',
+                                                                 '-r', 'foo', '--api-url', server.url])
 
 
 if __name__ == '__main__':
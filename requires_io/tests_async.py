@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Tests of the asyncio client, collected through tests.py on Python 3.7+ only: coroutines do not compile before."""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from requires_io.aio import AsyncRequiresAPI
+except ImportError:  # aiohttp not installed
+    AsyncRequiresAPI = None
+
+from requires_io.server import FakeServer
+
+
+class AsyncTestCase(unittest.TestCase):
+    @unittest.skipIf(AsyncRequiresAPI is None, 'requires aiohttp')
+    def test_async_api(self):
+        async def run(server, path):
+            async with AsyncRequiresAPI('1234', base_url=server.url, pool_maxsize=2) as api:
+                await api.update_repository('foo', True)
+                await api.gather(*[api.update_branch('foo', 'b%d' % i, {}) for i in range(20)], limit=5)
+                await api.gather(*[api.delete_branch('foo', 'b%d' % i) for i in range(20)], limit=5)
+                await api.update_tag('foo', 'bar', {path: 'requirements.txt'})
+                return await api.get_requirements(path)
+
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'requirements.txt')
+            with open(path, 'wb') as fd:
+                fd.write(b'six==1.0.0\n')
+            with FakeServer(token='1234', packages={'six': '1.1.0'}) as server:
+                requirements = asyncio.run(run(server, path))
+                self.assertEquals([('six', 'outdated')], [(r['package']['name'], r['status']) for r in requirements])
+                self.assertEquals(43, server.requests)
+                self.assertEquals({}, server.repositories['foo']['branches'])
+                self.assertEquals({'requirements.txt': b'six==1.0.0\n'}, server.reference_content('foo', 'tags', 'bar'))
+        finally:
+            shutil.rmtree(tmp)
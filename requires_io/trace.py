@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import os
+import threading
+import time
+
+
+class Tracer(object):
+    """Spans of a run, written as Chrome trace events.
+
+    Every span is a complete (``X``) event on the thread it ran in; the file
+    written by :meth:`write` opens in Perfetto or ``chrome://tracing``.
+    Timestamps are relative to ``origin`` (default: creation of the tracer).
+    """
+
+    enabled = True
+
+    def __init__(self, origin=None):
+        self.origin = time.time() if origin is None else origin
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, cat='requires.io', **args):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args,
+        }
+        with self._lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, cat='requires.io', **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), cat, **args)
+
+    def write(self, path):
+        import json
+
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                      for tid, name in self.threads.items()]
+            events.extend(self.events)
+        with open(path, 'w') as fd:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd)
+
+
+class NullTracer(object):
+    """Tracer recording nothing, used when tracing is off."""
+
+    enabled = False
+
+    def add(self, name, start, end, cat='requires.io', **args):
+        pass
+
+    def span(self, name, cat='requires.io', **args):
+        return _null_span
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Versions (PEP 440) and specifiers, and the status of requirements.
+
+Parsing is memoized in LRU caches: each distinct version or specifier string
+is parsed once and the same object is returned for it afterwards, so large
+requirement sets repeating the same pins are evaluated at the cost of their
+distinct strings. Versions that are not PEP 440 compliant sort before all the
+others, by their text.
+"""
+import re
+
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    import functools
+    import threading
+    from collections import OrderedDict
+
+    def lru_cache(maxsize=128):
+        def decorator(func):
+            cache = OrderedDict()
+            lock = threading.Lock()
+
+            @functools.wraps(func)
+            def wrapper(key):
+                with lock:
+                    try:
+                        value = cache.pop(key)
+                    except KeyError:
+                        value = func(key)
+                        if len(cache) >= maxsize:
+                            cache.popitem(last=False)
+                    cache[key] = value
+                    return value
+
+            wrapper.cache_clear = cache.clear
+            return wrapper
+        return decorator
+
+
+UP_TO_DATE = 'up-to-date'
+OUTDATED = 'outdated'
+UNKNOWN = 'unknown'
+
+VERSIONS_CACHE_SIZE = 64 * 1024
+SPECIFIERS_CACHE_SIZE = 16 * 1024
+
+_version_re = re.compile(r'''
+    ^\s*v?
+    (?:(?P<epoch>\d+)!)?
+    (?P<release>\d+(?:\.\d+)*)
+    (?:[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>\d+)?)?
+    (?:-(?P<post_n1>\d+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>\d+)?)?
+    (?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>\d+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$
+''', re.X | re.I)
+_clause_re = re.compile(r'^\s*(?P<operator>~=|===|==|!=|<=|>=|<|>)\s*(?P<version>[^\s,]+)\s*$')
+
+_PRE = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+
+
+class Version(object):
+    """Parsed version; ``key`` orders versions, ``public`` ignores the local part."""
+
+    __slots__ = ('text', 'release', 'key', 'public', 'local', 'prerelease')
+
+    def __init__(self, text, release, key, public, local=False, prerelease=False):
+        self.text = text
+        self.release = release
+        self.key = key
+        self.public = public
+        self.local = local
+        self.prerelease = prerelease
+
+    def __repr__(self):
+        return 'Version(%r)' % self.text
+
+
+def _parse_version(text):
+    match = _version_re.match(text)
+    if match is None:
+        return Version(text, (), (-1, text.lower()), (-1, text.lower()))
+    release = tuple(int(part) for part in match.group('release').split('.'))
+    trimmed = release
+    while len(trimmed) > 1 and trimmed[-1] == 0:
+        trimmed = trimmed[:-1]
+    post = match.group('post_n1') or match.group('post_n2') or (match.group('post_l') and '0')
+    dev = match.group('dev_l') and int(match.group('dev_n') or 0)
+    if match.group('pre_l'):
+        pre = (0, _PRE[match.group('pre_l').lower()], int(match.group('pre_n') or 0))
+    elif dev is not None and post is None:
+        # 1.0.dev0 sorts before 1.0a0
+        pre = (-1,)
+    else:
+        pre = (1,)
+    public = (0, int(match.group('epoch') or 0), trimmed, pre, -1 if post is None else int(post),
+              (1,) if dev is None else (0, dev))
+    local = match.group('local')
+    if local:
+        key = public + (tuple((1, int(part)) if part.isdigit() else (0, part.lower())
+                              for part in re.split(r'[-_.]', local)),)
+    else:
+        key = public + ((),)
+    return Version(text, release, key, public, bool(local), pre != (1,) or dev is not None)
+
+
+def _parse_specifier(text):
+    clauses = []
+    for clause in text.split(','):
+        if not clause.strip():
+            continue
+        match = _clause_re.match(clause)
+        if match is None:
+            return None
+        operator, version = match.group('operator'), match.group('version')
+        if version.endswith('.*'):
+            if operator not in ('==', '!='):
+                return None
+            clauses.append((operator + '*', parse_version(version[:-2])))
+        elif operator == '===':
+            clauses.append((operator, version))
+        else:
+            clauses.append((operator, parse_version(version)))
+    return tuple(clauses)
+
+
+parse_version = lru_cache(maxsize=VERSIONS_CACHE_SIZE)(_parse_version)
+parse_specifier = lru_cache(maxsize=SPECIFIERS_CACHE_SIZE)(_parse_specifier)
+
+
+def _prefix(version, release):
+    # same epoch and release starting with ``release``
+    padded = version.release + (0,) * (len(release) - len(version.release))
+    return padded[:len(release)] == release
+
+
+def _matches(version, operator, expected):
+    if operator == '===':
+        return version.text.lower() == expected.lower()
+    if operator == '==*':
+        return version.public[1] == expected.public[1] and _prefix(version, expected.release)
+    if operator == '!=*':
+        return not (version.public[1] == expected.public[1] and _prefix(version, expected.release))
+    # versions are compared without their local part, unless the specifier has one
+    if expected.local:
+        key, other = version.key, expected.key
+    else:
+        key, other = version.public, expected.public
+    if operator == '==':
+        return key == other
+    if operator == '!=':
+        return key != other
+    if operator == '>=':
+        return key >= other
+    if operator == '<=':
+        return key <= other
+    if operator == '>':
+        return key > other
+    if operator == '<':
+        return key < other
+    # ~=: at least the version, in the series of its release without the last part
+    return key >= other and version.public[1] == expected.public[1] and _prefix(version, expected.release[:-1])
+
+
+def contains(specifier, version):
+    """Whether ``version`` (a :class:`Version`) satisfies all the clauses of a parsed specifier."""
+    for operator, expected in specifier:
+        if not _matches(version, operator, expected):
+            return False
+    return True
+
+
+def latest(releases):
+    """Latest of ``releases``: the greatest final release, or the greatest release if none is final."""
+    versions = [parse_version(release) for release in releases if release]
+    if not versions:
+        return None
+    finals = [version for version in versions if not version.prerelease]
+    return max(finals or versions, key=lambda version: version.key).text
+
+
+def status(specs, version):
+    """Status of a requirement with these specifiers given the latest version of its package."""
+    if not version:
+        return UNKNOWN
+    specifier = parse_specifier(specs or '')
+    if specifier is None:
+        return UNKNOWN
+    return UP_TO_DATE if contains(specifier, parse_version(version)) else OUTDATED
+
+
+def statuses(pins):
+    """Status of each ``(specs, latest version)`` pair, evaluating each distinct pair once."""
+    results = {}
+    evaluated = []
+    for pin in pins:
+        try:
+            value = results[pin]
+        except KeyError:
+            value = results[pin] = status(*pin)
+        evaluated.append(value)
+    return evaluated
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Wait for changes of requirement files, grouped in debounced batches.
+
+On Linux, folders are watched with inotify (through ctypes): waiting costs no
+CPU and events arrive as soon as files are written. Elsewhere, or when
+inotify is not usable (watch limit reached for instance, even after the
+watch started), the requirement files are listed again and compared every
+``interval`` seconds. Only the folders discovery lists are watched: the
+whole tree when walking it, the folders of the tracked requirement files
+and the git index with ``--discovery git``.
+"""
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from requires_io.consts import GIT, WALK
+from requires_io.discovery import _ignored, discover, discover_git, match, mtime_ns
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# files are reported once written (not on each write), with the creations,
+# deletions and renames of files and folders
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+_event = struct.Struct('iIII')
+_encoding = sys.getfilesystemencoding()
+
+
+def _encode(path):
+    return path if isinstance(path, bytes) else path.encode(_encoding)
+
+
+def _decode(name):
+    fsdecode = getattr(os, 'fsdecode', None)
+    return fsdecode(name) if fsdecode else name
+
+
+def _folders(root):
+    # the folders walked by discovery below root
+    for folder, dirs, unused_files in os.walk(root):
+        dirs[:] = [d for d in dirs if not _ignored(d)]
+        yield folder
+
+
+def _split(paths):
+    folders = [path for path in paths if os.path.isdir(path)]
+    files = [path for path in paths if not os.path.isdir(path)]
+    return folders, files
+
+
+def _git_index(folder):
+    # index of the work tree of folder, changed by each git add, rm, checkout...
+    import subprocess
+
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', '--git-dir'], cwd=folder, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError:  # git not available
+        return None
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    return os.path.join(folder, _decode(output.strip()), 'index')
+
+
+def _discover(folder, mode):
+    found = discover_git(folder) if mode == GIT else None
+    return discover(folder, workers=1) if found is None else found
+
+
+class InotifyWatcher(object):
+    """Watch requirement files in ``paths``: folders (recursively) and files.
+
+    Folders are found as with the ``mode`` discovery. Raises ``OSError`` when
+    inotify is not available; once started, the watcher lists the files every
+    ``poll_interval`` seconds instead if inotify fails (watch limit reached).
+    """
+
+    def __init__(self, paths, mode=WALK, poll_interval=DEFAULT_POLL_INTERVAL):
+        import ctypes
+        import ctypes.util
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except (AttributeError, OSError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._get_errno = ctypes.get_errno
+        self.paths = paths
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.fallback = None
+        self.fd = self._init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = self._get_errno()
+            raise OSError(code, os.strerror(code))
+        # watch descriptor -> (folder, whether its requirement files are watched or only some files,
+        #                      whether its new sub-folders are watched too)
+        self.watches = {}
+        self.files = set()
+        # git index -> work tree folder it lists
+        self.indexes = {}
+        try:
+            folders, files = _split(paths)
+            for root in folders:
+                index = _git_index(root) if mode == GIT else None
+                if index is None:
+                    self._add_tree(root)
+                else:
+                    self.indexes[index] = root
+                    self._add_file(index)
+                    self._add_tracked(root)
+            for path in files:
+                self._add_file(path)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, folder, requirements=True, recursive=True):
+        wd = self._add_watch(self.fd, _encode(folder), WATCH_MASK)
+        if wd < 0:
+            code = self._get_errno()
+            if code in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                # removed since it was listed, or not readable: nothing to watch
+                return
+            raise OSError(code, '%s: %s' % (os.strerror(code), folder))
+        # the same folder always gets the same descriptor
+        unused_folder, was_requirements, was_recursive = self.watches.get(wd, (None, False, False))
+        self.watches[wd] = (folder, requirements or was_requirements, recursive or was_recursive)
+
+    def _add_file(self, path):
+        self.files.add(path)
+        self._add(os.path.dirname(path), requirements=False, recursive=False)
+
+    def _add_tree(self, root):
+        for folder in _folders(root):
+            self._add(folder)
+
+    def _add_tracked(self, root):
+        # folders of the requirement files in the index: others only matter once files are added to it
+        found = discover_git(root)
+        if found is None:
+            return self._add_tree(root)
+        for folder in set([root] + [os.path.dirname(path) for path in found]):
+            self._add(folder, recursive=False)
+
+    def _relevant(self, folder, name, requirements):
+        path = os.path.join(folder, name)
+        if path in self.files:
+            return True
+        return requirements and match(os.sep + os.path.basename(folder) + os.sep + name) is not None
+
+    def _fall_back(self, error):
+        log.warning('failed to watch with inotify (%s), listing files every %ss instead', error, self.poll_interval)
+        self.close()
+        self.fallback = PollingWatcher(self.paths, self.poll_interval, self.mode)
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, unused_cookie, size = _event.unpack_from(data, offset)
+            name = _decode(data[offset + _event.size:offset + _event.size + size].rstrip(b'\0'))
+            offset += _event.size + size
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: anything may have changed
+                log.warning('too many changes at once, some events were lost')
+                changed.update(folder for folder, unused_requirements, unused_recursive in self.watches.values())
+                continue
+            if wd not in self.watches:
+                continue
+            folder, requirements, recursive = self.watches[wd]
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.add(folder)
+                elif path in self.indexes:
+                    # files were added to or removed from git: their folders may be new
+                    if self.fallback is None:
+                        self._add_tracked(self.indexes[path])
+                    changed.add(path)
+                elif mask & IN_ISDIR:
+                    # folders can hold requirement files: the batch will tell if they did
+                    if recursive and not _ignored(name):
+                        if mask & (IN_CREATE | IN_MOVED_TO) and self.fallback is None:
+                            self._add_tree(path)
+                        changed.add(path)
+                elif self._relevant(folder, name, requirements):
+                    changed.add(path)
+            except OSError as e:
+                # out of watches for instance: the new folders would go unnoticed
+                changed.add(path)
+                self._fall_back(e)
+        return changed
+
+    def wait(self, timeout=None):
+        """Paths changed, as soon as some are, or an empty set after ``timeout`` seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.fallback is not None:
+                return self.fallback.wait(None if deadline is None else max(0, deadline - time.time()))
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            try:
+                ready = select.select([self.fd], [], [], remaining)[0]
+            except (OSError, select.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if not ready:
+                return set()
+            changed = self._read()
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher(object):
+    """Watch requirement files in ``paths`` by listing them every ``interval`` seconds, as ``mode`` discovers them."""
+
+    def __init__(self, paths, interval=DEFAULT_POLL_INTERVAL, mode=WALK):
+        self.folders, self.files = _split(paths)
+        self.interval = interval
+        self.mode = mode
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        paths = set(self.files)
+        for root in self.folders:
+            paths.update(_discover(root, self.mode))
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (mtime_ns(stat), stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(0, deadline - time.time()))
+            time.sleep(delay)
+            snapshot = self._snapshot()
+            changed = set(path for path in set(snapshot) | set(self.snapshot)
+                          if snapshot.get(path) != self.snapshot.get(path))
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(paths, poll_interval=None, mode=WALK):
+    """inotify watcher of ``paths``, or polling watcher if inotify is not usable or ``poll_interval`` is given.
+
+    Requirement files are found as with the ``mode`` discovery.
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(paths, mode)
+        except OSError as e:
+            log.warning('failed to watch with inotify (%s), listing files every %ss instead', e,
+                        DEFAULT_POLL_INTERVAL)
+    return PollingWatcher(paths, poll_interval or DEFAULT_POLL_INTERVAL, mode)
+
+
+def batches(watcher, debounce=DEFAULT_DEBOUNCE, max_delay=None, stop=None):
+    """Yield the set of paths changed by each burst of changes.
+
+    A batch is complete once nothing changed for ``debounce`` seconds, or
+    ``max_delay`` seconds (default: 10 debounce windows) after its first
+    change. ``stop`` is an optional ``threading.Event`` ending the iteration.
+    """
+    max_delay = debounce * 10 if max_delay is None else max_delay
+    while stop is None or not stop.is_set():
+        # without stop event to check, wait for the first change without waking up
+        changed = watcher.wait(None if stop is None else 0.1)
+        if not changed:
+            continue
+        deadline = time.time() + max_delay
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            more = watcher.wait(min(debounce, remaining))
+            if not more:
+                break
+            changed |= more
+        yield changed
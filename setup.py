@@ -20,6 +20,11 @@ try:
 except ImportError:
     install_requires.append('argparse >= 1.2.0')
 
+try:
+    import concurrent.futures
+except ImportError:
+    install_requires.append('futures >= 3.0.0')
+
 with codecs.open('README.rst', 'r', 'utf-8') as f:
     readme = f.read()
 with codecs.open('CHANGES.rst', 'r', 'utf-8') as f:
@@ -37,6 +42,9 @@ setup(
     include_package_data=False,
     zip_safe=True,
     install_requires=install_requires,
+    extras_require={
+        'async': ['aiohttp >= 3.0'],
+    },
     entry_points={
         'console_scripts': [
             'requires.io = requires_io.commands:main',